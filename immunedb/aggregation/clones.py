@@ -84,11 +84,15 @@ def similar_to_all(seq, rest, min_similarity):
     :rtype: bool
 
     """
-    for comp_seq in rest:
-        dist = dnautils.hamming(
-            comp_seq.cdr3_aa.replace('X', '-'),
-            seq.cdr3_aa.replace('X', '-')
-        )
+    dists = dnautils.hamming_many(
+        seq.cdr3_aa.replace('X', '-'),
+        [comp_seq.cdr3_aa.replace('X', '-') for comp_seq in rest]
+    )
+    return _all_similar(rest, dists, min_similarity)
+
+
+def _all_similar(seqs, dists, min_similarity):
+    for comp_seq, dist in zip(seqs, dists):
         sim_frac = 1 - dist / float(len(comp_seq.cdr3_aa))
         if sim_frac < min_similarity:
             return False
@@ -96,8 +100,12 @@ def similar_to_all(seq, rest, min_similarity):
 
 
 def can_subclone(sub_seqs, parent_seqs, min_similarity):
-    for seq in sub_seqs:
-        if not similar_to_all(seq, parent_seqs, min_similarity):
+    dists = dnautils.hamming_matrix(
+        [seq.cdr3_aa.replace('X', '-') for seq in sub_seqs],
+        [seq.cdr3_aa.replace('X', '-') for seq in parent_seqs]
+    )
+    for row in dists:
+        if not _all_similar(parent_seqs, row, min_similarity):
             return False
     return True
 
@@ -236,13 +244,16 @@ class TCellClonalWorker(ClonalWorker):
             if key in clones:
                 clone = clones[key]
             else:
-                for test_clone in clones.values():
-                    same_bin = (test_clone.v_gene == key[0] and
-                                test_clone.j_gene == key[1] and
-                                test_clone.cdr3_num_nts == len(key[2]))
-                    if same_bin and dnautils.equal(test_clone.cdr3_nt, key[2]):
-                        clone = test_clone
-                        break
+                same_bin = [
+                    test_clone for test_clone in clones.values()
+                    if (test_clone.v_gene == key[0] and
+                        test_clone.j_gene == key[1] and
+                        test_clone.cdr3_num_nts == len(key[2]))
+                ]
+                match = dnautils.equal_any(
+                    key[2], [test_clone.cdr3_nt for test_clone in same_bin])
+                if match >= 0:
+                    clone = same_bin[match]
                 else:
                     new_clone = Clone(subject_id=seq.subject_id,
                                       v_gene=seq.v_gene,
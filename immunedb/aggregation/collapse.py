@@ -1,11 +1,11 @@
 from sqlalchemy.sql import exists
 
-import dnautils
 import immunedb.common.config as config
 from immunedb.common.models import (Clone, Sample, Sequence, SequenceCollapse,
                                     Subject)
 import immunedb.common.modification_log as mod_log
 import immunedb.util.concurrent as concurrent
+import immunedb.util.funcs as funcs
 
 from immunedb.util.log import logger
 
@@ -32,26 +32,30 @@ class CollapseWorker(concurrent.Worker):
             Sequence._deletions == bucket._deletions
         ).all()
 
+        keys, equal_many = funcs.get_equal_many([s.sequence for s in seqs])
         to_process = sorted([{
             'sample_id': s.sample_id,
             'ai': s.ai,
             'seq_id': s.seq_id,
             'sequence': s.sequence,
+            'key': key,
             'cn': s.copy_number
-        } for s in seqs], key=lambda e: -e['cn'])
+        } for s, key in zip(seqs, keys)], key=lambda e: -e['cn'])
 
         while len(to_process) > 0:
             # Get the largest sequence in the list
             larger = to_process.pop(0)
             # Iterate over all smaller sequences to find matches
             instances = 1
+            equal = equal_many(larger['key'],
+                               [s['key'] for s in to_process])
             for i in reversed(range(0, len(to_process))):
                 smaller = to_process[i]
                 if len(larger['sequence']) != len(smaller['sequence']):
                     self.warning('Tried to collapse sequences of different '
                                  'lengths.  AIs are {} {}'.format(
                                      larger['ai'], smaller['ai']))
-                elif dnautils.equal(larger['sequence'], smaller['sequence']):
+                elif equal[i]:
                     # Add the smaller sequence's copy number to the larger
                     larger['cn'] += smaller['cn']
                     # If the smaller sequence matches the larger, collapse it
@@ -673,6 +673,32 @@ class NoResult(Base):
     reason = Column(String(256))
 
 
+class IdentificationProgress(Base):
+    """Whether identification of a sample completed, recorded when it starts
+    so that samples left incomplete by an interrupted run can be found and
+    identified again.
+
+    :param int sample_id: The ID of the sample
+    :param Relationship sample: Reference to the associated \
+        :py:class:`Sample` instance
+    :param bool complete: If everything identified for the sample has been
+        committed
+    :param datetime updated: The date and time identification of the sample
+        started or completed
+
+    """
+    __tablename__ = 'identification_progress'
+    __table_args__ = {'mysql_row_format': 'DYNAMIC'}
+
+    sample_id = Column(Integer, ForeignKey(Sample.id), primary_key=True,
+                       autoincrement=False)
+    sample = relationship(Sample)
+
+    complete = Column(Boolean, nullable=False, default=False)
+    updated = Column(DateTime, default=datetime.datetime.utcnow,
+                     onupdate=datetime.datetime.utcnow)
+
+
 class ModificationLog(Base):
     """A log message for a database modification
 
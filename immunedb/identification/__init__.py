@@ -1,10 +1,10 @@
 from collections import OrderedDict
-import dnautils
 import itertools
 import traceback
 
-from immunedb.common.models import (CDR3_OFFSET, DuplicateSequence, NoResult,
-                                    Sequence)
+from immunedb.common.models import (CDR3_OFFSET, DuplicateSequence,
+                                    IdentificationProgress, NoResult,
+                                    Sequence, SequenceCollapse)
 import immunedb.util.funcs as funcs
 import immunedb.util.lookups as lookups
 from immunedb.util.log import logger
@@ -29,55 +29,59 @@ def add_as_noresult(session, vdj, sample, reason):
         pass
 
 
-def add_as_sequence(session, alignment, sample, error_action='discard'):
-    try:
-        seq = Sequence(
-            seq_id=alignment.sequence.ids[0],
-            sample_id=sample.id,
+def _create_sequence(alignment, sample):
+    return Sequence(
+        seq_id=alignment.sequence.ids[0],
+        sample_id=sample.id,
+
+        subject_id=sample.subject.id,
 
-            subject_id=sample.subject.id,
+        partial=alignment.partial,
 
-            partial=alignment.partial,
+        probable_indel_or_misalign=alignment.has_possible_indel,
 
-            probable_indel_or_misalign=alignment.has_possible_indel,
+        v_gene=funcs.format_ties(alignment.v_gene),
+        j_gene=funcs.format_ties(alignment.j_gene),
 
-            v_gene=funcs.format_ties(alignment.v_gene),
-            j_gene=funcs.format_ties(alignment.j_gene),
+        num_gaps=alignment.num_gaps,
+        seq_start=alignment.seq_start,
 
-            num_gaps=alignment.num_gaps,
-            seq_start=alignment.seq_start,
+        v_match=alignment.v_match,
+        v_length=alignment.v_length,
+        j_match=alignment.j_match,
+        j_length=alignment.j_length,
 
-            v_match=alignment.v_match,
-            v_length=alignment.v_length,
-            j_match=alignment.j_match,
-            j_length=alignment.j_length,
+        removed_prefix=alignment.sequence.removed_prefix_sequence,
+        removed_prefix_qual=alignment.sequence.removed_prefix_quality,
+        v_mutation_fraction=alignment.v_mutation_fraction,
 
-            removed_prefix=alignment.sequence.removed_prefix_sequence,
-            removed_prefix_qual=alignment.sequence.removed_prefix_quality,
-            v_mutation_fraction=alignment.v_mutation_fraction,
+        pre_cdr3_length=alignment.pre_cdr3_length,
+        pre_cdr3_match=alignment.pre_cdr3_match,
+        post_cdr3_length=alignment.post_cdr3_length,
+        post_cdr3_match=alignment.post_cdr3_match,
 
-            pre_cdr3_length=alignment.pre_cdr3_length,
-            pre_cdr3_match=alignment.pre_cdr3_match,
-            post_cdr3_length=alignment.post_cdr3_length,
-            post_cdr3_match=alignment.post_cdr3_match,
+        in_frame=alignment.in_frame,
+        functional=alignment.functional,
+        stop=alignment.stop,
+        copy_number=len(alignment.sequence.ids),
 
-            in_frame=alignment.in_frame,
-            functional=alignment.functional,
-            stop=alignment.stop,
-            copy_number=len(alignment.sequence.ids),
+        cdr3_nt=alignment.cdr3,
+        cdr3_num_nts=len(alignment.cdr3),
+        cdr3_aa=lookups.aas_from_nts(alignment.cdr3),
 
-            cdr3_nt=alignment.cdr3,
-            cdr3_num_nts=len(alignment.cdr3),
-            cdr3_aa=lookups.aas_from_nts(alignment.cdr3),
+        sequence=str(alignment.sequence.sequence),
+        quality=alignment.sequence.quality,
 
-            sequence=str(alignment.sequence.sequence),
-            quality=alignment.sequence.quality,
+        locally_aligned=alignment.locally_aligned,
+        insertions=alignment.insertions,
+        deletions=alignment.deletions,
 
-            locally_aligned=alignment.locally_aligned,
-            insertions=alignment.insertions,
-            deletions=alignment.deletions,
+        germline=alignment.germline)
 
-            germline=alignment.germline)
+
+def add_as_sequence(session, alignment, sample, error_action='discard'):
+    try:
+        seq = _create_sequence(alignment, sample)
         session.add(seq)
         session.flush()
 
@@ -101,16 +105,131 @@ def add_as_sequence(session, alignment, sample, error_action='discard'):
             raise e
 
 
+def write_sequences(session, sample_id, sequences):
+    """Inserts sequences and their duplicates.  The sequences are inserted
+    together, their auto-increment values are looked up with one query, and
+    then their duplicates are inserted together.
+
+    :param Session session: The database session
+    :param int sample_id: The ID of the sample of the sequences
+    :param list sequences: A list of ``(sequence, duplicates)`` tuples where
+        ``sequence`` is a :py:class:`Sequence` and ``duplicates`` is a list of
+        its :py:class:`DuplicateSequence` instances without
+        ``duplicate_seq_ai`` set
+
+    """
+    if len(sequences) == 0:
+        return
+    # Sequences are inserted in order so their auto-increment values are
+    # assigned in the same order as when added one at a time
+    session.bulk_save_objects([seq for seq, _ in sequences])
+    ais = dict(session.query(
+        Sequence.seq_id, Sequence.ai
+    ).filter(
+        Sequence.sample_id == sample_id,
+        Sequence.seq_id.in_([seq.seq_id for seq, _ in sequences])
+    ))
+
+    all_duplicates = []
+    for seq, duplicates in sequences:
+        for duplicate in duplicates:
+            duplicate.duplicate_seq_ai = ais[seq.seq_id]
+        all_duplicates.extend(duplicates)
+    session.bulk_save_objects(all_duplicates)
+
+
+def rollback_sample(session, sample_id):
+    """Deletes everything identification wrote for a sample, along with its
+    identification progress, with one statement per table rather than one
+    per row.
+
+    :param Session session: The database session
+    :param int sample_id: The ID of the sample
+
+    :returns: The number of rows deleted from each table
+    :rtype: OrderedDict
+
+    """
+    deleted = OrderedDict()
+    # Rows referencing sequences are deleted before the sequences.  Deleted
+    # instances are also removed from the session so the sample's progress
+    # can be recorded again in it.
+    for model in (SequenceCollapse, DuplicateSequence, Sequence, NoResult,
+                  IdentificationProgress):
+        deleted[model.__tablename__] = session.query(model).filter(
+            model.sample_id == sample_id
+        ).delete(synchronize_session='evaluate')
+    session.commit()
+    return deleted
+
+
+class SequenceWriter(object):
+    """Writes sequences and their duplicates to the database in batches with
+    :py:func:`write_sequences` rather than flushing each sequence to get its
+    auto-increment value.
+
+    As in :py:func:`add_as_sequence`, sequences which fail validation are
+    added as :py:class:`NoResult` instances, and if any duplicate of a
+    sequence fails validation none of its duplicates are added.
+
+    :param Session session: The database session
+    :param Sample sample: The sample of the sequences
+    :param int batch_size: The number of sequences to buffer before writing
+
+    """
+    def __init__(self, session, sample, batch_size=1000):
+        self._session = session
+        self._sample = sample
+        self._batch_size = batch_size
+        self._pending = []
+
+    def add(self, alignment):
+        try:
+            seq = _create_sequence(alignment, self._sample)
+        except ValueError as e:
+            add_as_noresult(self._session, alignment.sequence, self._sample,
+                            str(e))
+            return
+
+        try:
+            duplicates = [
+                DuplicateSequence(sample_id=self._sample.id, seq_id=seq_id)
+                for seq_id in alignment.sequence.ids[1:]
+            ]
+        except ValueError:
+            duplicates = []
+        self._pending.append((seq, duplicates))
+
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered sequences and their duplicates"""
+        if len(self._pending) > 0:
+            self._write(self._pending)
+            self._pending = []
+
+    def _write(self, sequences):
+        write_sequences(self._session, self._sample.id, sequences)
+
+
+def realign_to_ties(alignment, props, aligner, realign_len, realign_mut):
+    aligner.align_to_germline(alignment, realign_len, realign_mut)
+    if props.trim_to:
+        alignment.trim_to(props.trim_to)
+
+
 def add_uniques(session, sample, alignments, props, aligner, realign_len=None,
-                realign_mut=None):
+                realign_mut=None, writer=None):
+    if writer is None:
+        writer = SequenceWriter(session, sample)
     bucketed_seqs = OrderedDict()
     alignments = sorted(alignments, key=lambda v: v.sequence.ids[0])
     for alignment in funcs.periodic_commit(session, alignments):
         try:
             if realign_len is not None:
-                aligner.align_to_germline(alignment, realign_len, realign_mut)
-                if props.trim_to:
-                    alignment.trim_to(props.trim_to)
+                realign_to_ties(alignment, props, aligner, realign_len,
+                                realign_mut)
 
             props.validate(alignment)
             bucket_key = (
@@ -144,16 +263,18 @@ def add_uniques(session, sample, alignments, props, aligner, realign_len=None,
             key=lambda s: (len(s.sequence.ids), s.sequence.ids[0]),
             reverse=True
         )
+        keys, equal_many = funcs.get_equal_many(
+            [s.sequence.sequence for s in sequences])
         while len(sequences) > 0:
             larger = sequences.pop(0)
+            equal = equal_many(keys.pop(0), keys)
             for i in reversed(range(len(sequences))):
-                smaller = sequences[i]
-
-                if dnautils.equal(larger.sequence.sequence,
-                                  smaller.sequence.sequence):
-                    larger.sequence.ids += smaller.sequence.ids
+                if equal[i]:
+                    larger.sequence.ids += sequences[i].sequence.ids
                     del sequences[i]
-            add_as_sequence(session, larger, sample)
+                    del keys[i]
+            writer.add(larger)
+    writer.flush()
     session.commit()
 
 
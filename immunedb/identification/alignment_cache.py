@@ -0,0 +1,261 @@
+import hashlib
+import marshal
+import multiprocessing as mp
+from multiprocessing.util import Finalize
+import os
+import sqlite3
+import time
+
+from immunedb.identification import AlignmentException
+from immunedb.identification.vdj_sequence import VDJAlignment
+
+
+class AlignmentCache(object):
+    """An on-disk cache of first-pass alignments, those from
+    :py:meth:`AnchorAligner.get_alignment` before any re-alignment to
+    V-ties, keyed by the sequence of each read.  Sequences which could not be
+    aligned are cached along with the reason.
+
+    Entries are stored in a SQLite database so the cache may be shared by
+    concurrent processes and runs.  The key of each entry includes a hash of
+    the germlines and identification properties, so a cache is only used by
+    runs with the same parameters.  Once the entries exceed ``max_size``
+    bytes, the least recently used are evicted.  So that hits do not wait on
+    the write lock, the times entries were last used are updated in batches.
+
+    Hits and misses are counted across all processes forked after the cache
+    is created, such as those of a pool, and can be read with
+    :py:meth:`get_stats`.
+
+    :param str path: The path to the cache database
+    :param VGermlines v_germlines: The V germlines
+    :param JGermlines j_germlines: The J germlines
+    :param IdentificationProps props: The identification properties
+    :param int max_size: The approximate maximum number of bytes of entries,
+        or ``None`` for no limit
+
+    """
+    # Incremented when the aligner or the format of entries changes
+    # incompatibly
+    VERSION = 1
+    # Approximate bytes used by an entry in addition to its value
+    ENTRY_OVERHEAD = 64
+    # Entries are evicted to this fraction of max_size at a time
+    EVICT_TO = .9
+    # The number of entries read at a time while evicting
+    EVICT_BATCH = 1000
+    # The number of hits after which the times their entries were used are
+    # written, if not written sooner along with an added entry
+    TOUCH_BATCH = 1000
+
+    def __init__(self, path, v_germlines, j_germlines, props, max_size=None):
+        self._path = path
+        self._v_germlines = v_germlines
+        self._j_germlines = j_germlines
+        self._max_size = max_size
+        self._namespace = self._get_namespace(props)
+        self._hits = mp.Value('l', 0)
+        self._misses = mp.Value('l', 0)
+        self._evicted = mp.Value('l', 0)
+        self._gene_names = None
+        self._conn = None
+        self._pid = None
+        self._touched = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_pid'] = None
+        state['_touched'] = []
+        return state
+
+    def get_alignment(self, aligner, vdj, limit_vs=None, limit_js=None):
+        """Gets the alignment of ``vdj`` from the cache, or aligns it with
+        ``aligner`` and adds it to the cache.
+
+        :param AnchorAligner aligner: The aligner to use on a miss
+        :param VDJSequence vdj: The sequence to align
+        :param list limit_vs: Passed to the aligner
+        :param list limit_js: Passed to the aligner
+
+        :returns: The alignment
+        :rtype: VDJAlignment
+
+        :raises AlignmentException: If the sequence could not be aligned
+
+        """
+        key = self._get_key(vdj.sequence, limit_vs, limit_js)
+        conn = self._connect()
+        row = conn.execute('SELECT value FROM alignments WHERE key=?',
+                           (key,)).fetchone()
+        if row is not None:
+            self._increment(self._hits)
+            self._touched.append((time.time(), key))
+            if len(self._touched) >= self.TOUCH_BATCH:
+                with conn:
+                    self._write_touched(conn)
+            return self._load(vdj, marshal.loads(str(row[0])))
+
+        self._increment(self._misses)
+        try:
+            alignment = aligner.get_alignment(vdj, limit_vs=limit_vs,
+                                              limit_js=limit_js)
+        except AlignmentException as e:
+            self._add(key, (str(e),))
+            raise
+        self._add(key, self._dump(vdj, alignment))
+        return alignment
+
+    def get_stats(self, reset=True):
+        """Gets the number of hits, misses, and evicted entries.
+
+        :param bool reset: If the counts should be reset
+
+        :returns: A dictionary with keys ``hits``, ``misses``, and
+            ``evicted``
+        :rtype: dict
+
+        """
+        stats = {}
+        for name in ('hits', 'misses', 'evicted'):
+            counter = getattr(self, '_' + name)
+            with counter.get_lock():
+                stats[name] = counter.value
+                if reset:
+                    counter.value = 0
+        return stats
+
+    def close(self):
+        if self._conn is not None:
+            if self._pid == os.getpid() and len(self._touched) > 0:
+                with self._conn:
+                    self._write_touched(self._conn)
+            self._conn.close()
+            self._conn = None
+
+    def _get_namespace(self, props):
+        key = hashlib.sha1()
+        key.update(str(self.VERSION))
+        for genes in (self._v_germlines, self._j_germlines):
+            for name, sequence in sorted(genes.iteritems()):
+                key.update('{}\0{}\0'.format(name, sequence))
+        key.update(str((self._j_germlines.upstream_of_cdr3,
+                        self._j_germlines.anchor_len)))
+        key.update(str(sorted((anchor, str(name)) for anchor, name in
+                              self._j_germlines.get_all_anchors())))
+        key.update(str(sorted(vars(props).items())))
+        return key.digest()
+
+    def _get_key(self, sequence, limit_vs, limit_js):
+        key = hashlib.sha1(self._namespace)
+        key.update(sequence)
+        for limit in (limit_vs, limit_js):
+            key.update('\0')
+            if limit is not None:
+                key.update(','.join(sorted(limit)))
+        return buffer(key.digest())
+
+    def _connect(self):
+        # Connections cannot be shared with forked processes so each process
+        # opens its own
+        if self._conn is None or self._pid != os.getpid():
+            if self._pid != os.getpid():
+                # Hits of the parent process are left for it to write.
+                # Processes such as those of a pool are not closed
+                # explicitly, so their hits are written as they exit.
+                self._touched = []
+                Finalize(None, self.close, exitpriority=0)
+            self._conn = sqlite3.connect(self._path, timeout=60)
+            self._pid = os.getpid()
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            with self._conn:
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS alignments (key BLOB PRIMARY '
+                    'KEY, value BLOB, size INTEGER, used REAL)')
+                self._conn.execute(
+                    'CREATE INDEX IF NOT EXISTS alignments_used ON '
+                    'alignments (used)')
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS totals (size INTEGER)')
+                if self._conn.execute(
+                        'SELECT COUNT(*) FROM totals').fetchone()[0] == 0:
+                    self._conn.execute('INSERT INTO totals VALUES (0)')
+        return self._conn
+
+    def _add(self, key, value):
+        value = marshal.dumps(value)
+        size = len(key) + len(value) + self.ENTRY_OVERHEAD
+        conn = self._connect()
+        evicted = 0
+        with conn:
+            # Hits are written while the write lock is held for the insert,
+            # and before evicting so their entries are not evicted as unused
+            self._write_touched(conn)
+            inserted = conn.execute(
+                'INSERT OR IGNORE INTO alignments VALUES (?, ?, ?, ?)',
+                (key, buffer(value), size, time.time())).rowcount
+            if inserted:
+                conn.execute('UPDATE totals SET size=size+?', (size,))
+                # The insert holds the write lock so no other process can
+                # evict concurrently
+                total = conn.execute('SELECT size FROM totals').fetchone()[0]
+                if self._max_size is not None and total > self._max_size:
+                    evicted = self._evict(conn, total)
+        if evicted > 0:
+            self._increment(self._evicted, evicted)
+
+    def _write_touched(self, conn):
+        conn.executemany('UPDATE alignments SET used=? WHERE key=?',
+                         self._touched)
+        self._touched = []
+
+    def _evict(self, conn, total):
+        target = self._max_size * self.EVICT_TO
+        evicted = 0
+        while total > target:
+            rows = conn.execute(
+                'SELECT key, size FROM alignments ORDER BY used LIMIT ?',
+                (self.EVICT_BATCH,)).fetchall()
+            if len(rows) == 0:
+                break
+            for key, size in rows:
+                conn.execute('DELETE FROM alignments WHERE key=?', (key,))
+                total -= size
+                evicted += 1
+                if total <= target:
+                    break
+        conn.execute('UPDATE totals SET size=?', (max(0, total),))
+        return evicted
+
+    def _dump(self, vdj, alignment):
+        # The aligner only reverse complements the sequence, so the fields of
+        # the alignment and the orientation are enough to restore it
+        values = []
+        for field in VDJAlignment._FIELDS[1:]:
+            value = getattr(alignment, field)
+            if field in ('v_gene', 'j_gene'):
+                value = tuple(sorted(gene.name for gene in value))
+            values.append(value)
+        return (None, alignment.sequence is not vdj, tuple(values))
+
+    def _load(self, vdj, entry):
+        if entry[0] is not None:
+            raise AlignmentException(entry[0])
+        _, is_rc, values = entry
+        if self._gene_names is None:
+            self._gene_names = {
+                gene.name: gene for genes in (self._v_germlines,
+                                              self._j_germlines)
+                for gene in genes
+            }
+        alignment = VDJAlignment(vdj.reverse_complement() if is_rc else vdj)
+        for field, value in zip(VDJAlignment._FIELDS[1:], values):
+            if field in ('v_gene', 'j_gene'):
+                value = set(self._gene_names[name] for name in value)
+            setattr(alignment, field, value)
+        return alignment
+
+    def _increment(self, counter, amount=1):
+        with counter.get_lock():
+            counter.value += amount
@@ -1,26 +1,62 @@
 import dnautils
+import numpy as np
 
 from immunedb.common.models import CDR3_OFFSET
 from immunedb.identification import AlignmentException, get_common_seq
-from immunedb.identification.genes import VGene, find_v_position
+from immunedb.identification.genes import (get_kmer_presence, VGene,
+                                           find_v_position)
 from immunedb.util.funcs import find_streak_position
 from immunedb.identification.vdj_sequence import VDJAlignment
 
 
-def sliding_window_match(sequence, match):
-    for pos in range(len(sequence) - len(match)):
-        ss = sequence[pos:pos + len(match)]
-        if dnautils.equal(ss, match):
-            return pos
-    return -1
-
-
 class AnchorAligner(object):
+    """Aligns sequences to germlines based on their V and J anchors.
+
+    :param VGermlines v_germlines: The V germlines
+    :param JGermlines j_germlines: The J germlines
+    :param int v_prefilter: If specified, each sequence is first compared
+        only to the V germlines sharing the most k-mers with it, this many
+        along with their ties and alleles.  All germlines are compared if none
+        of those are valid.
+    :param int min_germline_kmers: If specified, sequences which share fewer
+        than this many k-mers with the germlines on both strands are rejected
+        before searching for anchors
+    :param int j_fallback_max_distance: If specified, sequences with no J
+        anchor are rejected unless some J germline is within this hamming
+        distance of a window of the sequence
+
+    """
     MISMATCH_THRESHOLD = 3
-
-    def __init__(self, v_germlines, j_germlines):
+    # A sequence is only searched in one orientation if it has at least
+    # ORIENTATION_MIN_VOTES k-mers in the germlines and ORIENTATION_RATIO
+    # times as many as its reverse complement, or vice versa
+    ORIENTATION_KMER_SIZE = 10
+    ORIENTATION_MIN_VOTES = 10
+    ORIENTATION_RATIO = 4
+    # The prefix of the reason for rejecting sequences with too few k-mers in
+    # the germlines
+    GERMLINE_KMERS_REASON = 'Too few k-mers shared with germlines'
+
+    def __init__(self, v_germlines, j_germlines, v_prefilter=None,
+                 min_germline_kmers=None, j_fallback_max_distance=None):
         self.v_germlines = v_germlines
         self.j_germlines = j_germlines
+        self.v_prefilter = v_prefilter
+        self.min_germline_kmers = min_germline_kmers
+        self.j_fallback_max_distance = j_fallback_max_distance
+        self._j_fallback_germlines = j_germlines.values()
+        self._all_v_rows = np.arange(len(v_germlines.names))
+        # Views of the germlines filtered to each distinct set of limited
+        # genes.  Imports limit each sequence to the genes it was assigned,
+        # of which there are few distinct sets.
+        self._j_subsets = {}
+        self._v_subsets = {}
+        if v_prefilter:
+            self._kmer_index = v_germlines.get_kmer_index()
+        self._orientation_kmers = get_kmer_presence(
+            [v.replace('-', '') for v in v_germlines.values()] +
+            j_germlines.values(),
+            self.ORIENTATION_KMER_SIZE)
 
     def get_alignment(self, vdj_sequence, limit_vs=None, limit_js=None):
         alignment = VDJAlignment(vdj_sequence)
@@ -28,27 +64,47 @@ class AnchorAligner(object):
         self.find_v(alignment, limit_vs)
         return alignment
 
-    def _find_index(self, sequence, germline):
-        best_pos, best_hamming = None, None
-        for pos in range(len(sequence) - len(germline)):
-            hamming = dnautils.hamming(sequence[pos:pos + len(germline)],
-                                       germline)
-            if best_hamming is None or hamming < best_hamming:
-                best_pos = pos
-                best_hamming = hamming
-                is_rc = False
-
-        rc = sequence.reverse_complement(in_place=False)
-        for pos in range(len(rc) - len(germline)):
-            hamming = dnautils.hamming(rc[pos:pos + len(germline)],
-                                       germline)
-            if best_hamming is None or hamming < best_hamming:
-                best_pos = pos
-                best_hamming = hamming
-                is_rc = True
-
-        best_pos += len(germline) - self.j_germlines.anchor_len
-        return best_pos, best_hamming, is_rc
+    def _get_j_subset(self, limit_js):
+        # Gets the germlines and anchor index of the J genes in limit_js
+        key = frozenset(limit_js)
+        if key not in self._j_subsets:
+            self._j_subsets[key] = (
+                {k: v for k, v in self.j_germlines.iteritems()
+                 if k.name in key},
+                self.j_germlines.get_anchor_index(key)
+            )
+        return self._j_subsets[key]
+
+    def _get_v_subset(self, limit_vs):
+        # Gets a mask of the V genes in limit_vs over all germline rows
+        key = frozenset(limit_vs)
+        if key not in self._v_subsets:
+            self._v_subsets[key] = np.array(
+                [name.name in key for name in self.v_germlines.names],
+                dtype=bool)
+        return self._v_subsets[key]
+
+    def _orient(self, alignment):
+        # Determines the orientation of the sequence from its k-mers in the
+        # germlines, reverse complementing it if necessary.  Returns False if
+        # the orientation is ambiguous.
+        forward, reverse = dnautils.strand_votes(
+            alignment.sequence.sequence, self.ORIENTATION_KMER_SIZE,
+            self._orientation_kmers)
+        if (self.min_germline_kmers and
+                max(forward, reverse) < self.min_germline_kmers):
+            # Most likely not an immunoglobulin or TCR sequence
+            raise AlignmentException('{} {} < {}'.format(
+                self.GERMLINE_KMERS_REASON, max(forward, reverse),
+                self.min_germline_kmers))
+        if forward >= max(self.ORIENTATION_MIN_VOTES,
+                          self.ORIENTATION_RATIO * reverse):
+            return True
+        if reverse >= max(self.ORIENTATION_MIN_VOTES,
+                          self.ORIENTATION_RATIO * forward):
+            alignment.sequence = alignment.sequence.reverse_complement()
+            return True
+        return False
 
     def find_j(self, alignment, limit_js):
         # Iterate over every possible J anchor.  For each germline, try its
@@ -59,44 +115,47 @@ class AnchorAligner(object):
         # TGGTCACCGTCTCCTCAG
         # TGGTCACCGTCTCCT
         # TGGTCACCGTCT
-
-        rc = alignment.sequence.reverse_complement(in_place=False)
-        for match, j_gene in self.j_germlines.get_all_anchors(limit_js):
-            i = alignment.sequence.rfind(match)
-            if i >= 0:
-                return self.process_j(alignment, i, len(match), limit_js)
-
-            i = rc.rfind(match)
-            if i >= 0:
-                alignment.sequence = rc
-                return self.process_j(alignment, i, len(match), limit_js)
-
-            i = sliding_window_match(alignment.sequence, match)
-            if i >= 0:
-                return self.process_j(alignment, i, len(match), limit_js)
-
-            i = sliding_window_match(rc, match)
-            if i >= 0:
+        #
+        # The anchors are searched in this order using the germlines' anchor
+        # index.  Only one strand is searched if the orientation of the
+        # sequence is clear.
+        if self._orient(alignment):
+            rc = None
+            strands = [(False, alignment.sequence)]
+        else:
+            rc = alignment.sequence.reverse_complement(in_place=False)
+            strands = [(False, alignment.sequence), (True, rc)]
+        if limit_js is None:
+            anchor_index = self.j_germlines.get_anchor_index()
+        else:
+            anchor_index = self._get_j_subset(limit_js)[1]
+        found = anchor_index.find(alignment.sequence.sequence,
+                                  rc.sequence if rc else None)
+        if found is not None:
+            match, i, is_rc = found
+            if is_rc:
                 alignment.sequence = rc
-                return self.process_j(alignment, i, len(match), limit_js)
-
-        # Last chance, find any matching position
-        total_best_hamming = None
-        total_best_rc, total_best_pos = None, None
-        for j_gene, germ_seq in self.j_germlines.iteritems():
-            best_pos, best_hamming, is_rc = self._find_index(
-                alignment.sequence, germ_seq)
-            if (total_best_hamming is None or
-                    best_hamming < total_best_hamming):
-                total_best_hamming = best_hamming
-                total_best_pos = best_pos
-                total_best_rc = is_rc
-
-        if total_best_rc:
+            return self.process_j(alignment, i, len(match), limit_js)
+
+        # Last chance, find the position of any germline with the fewest
+        # mismatches.  The window ending at the last position of a strand is
+        # not searched.
+        found = dnautils.min_hamming_windows(
+            [strand.sequence[:-1] for _, strand in strands],
+            self._j_fallback_germlines, 0,
+            self.j_fallback_max_distance
+            if self.j_fallback_max_distance is not None else -1)
+        if found is None:
+            raise AlignmentException('Could not find suitable J anchor')
+        germ_index, strand_index, pos, _ = found
+        if strands[strand_index][0]:
             alignment.sequence = rc
 
-        return self.process_j(alignment, total_best_pos,
-                              self.j_germlines.anchor_len, limit_js)
+        return self.process_j(
+            alignment,
+            pos + len(self._j_fallback_germlines[germ_index]) -
+            self.j_germlines.anchor_len,
+            self.j_germlines.anchor_len, limit_js)
 
     def process_j(self, alignment, i, match_len, limit_js):
         # If a match is found, record its location and gene
@@ -107,10 +166,7 @@ class AnchorAligner(object):
         )
         best_dist = None
         if limit_js:
-            j_germs = {
-                k: v for k, v in self.j_germlines.iteritems()
-                if k.name in limit_js
-            }
+            j_germs = self._get_j_subset(limit_js)[0]
         else:
             j_germs = self.j_germlines
 
@@ -171,42 +227,67 @@ class AnchorAligner(object):
         alignment.post_cdr3_length = self.j_germlines.upstream_of_cdr3
 
     def find_v(self, alignment, limit_vs):
-        for anchor_pos in find_v_position(alignment.sequence.sequence):
-            self.process_v(alignment, anchor_pos, limit_vs)
-            if len(alignment.v_gene) > 0:
-                break
+        sequence = alignment.sequence.sequence
+        # The sequence is compared to the germlines at its first anchor, which
+        # is this one unless it contains gaps.  The comparison does not depend
+        # on the anchor position so if no germline matches at the first, none
+        # will at any later one.
+        anchor_pos = next(find_v_position(sequence), None)
+        if anchor_pos is not None:
+            aligned_v = VGene(
+                sequence, anchor_pos if '-' not in sequence else None)
+            rows = None
+            if self.v_prefilter:
+                rows = self._kmer_index.shortlist(
+                    aligned_v.sequence_ungapped, self.v_prefilter)
+            self.process_v(alignment, anchor_pos, limit_vs, aligned_v, rows)
 
         if len(alignment.v_gene) == 0:
             raise AlignmentException('Could not find suitable V anchor')
 
-    def process_v(self, alignment, anchor_pos, limit_vs):
-        aligned_v = VGene(alignment.sequence.sequence)
-        v_score = None
-        for v, germ in sorted(self.v_germlines.alignments.iteritems()):
-            if limit_vs is not None and v.name not in limit_vs:
-                continue
-            try:
-                dist, total_length = germ.compare(aligned_v,
-                                                  alignment.j_anchor_pos,
-                                                  self.MISMATCH_THRESHOLD)
-            except Exception:
-                continue
-            # Record this germline if it is has the lowest distance
-            if dist is not None:
-                if v_score is None or dist < v_score:
-                    alignment.v_gene = set([v])
-                    alignment.v_length = total_length
-                    germ_pos = germ.ungapped_anchor_pos
-                    v_score = dist
-                elif dist == v_score:
-                    # Add the V-tie
-                    alignment.v_gene.add(v)
-
-        if len(alignment.v_gene) > 0:
-            # Determine the pad length
-            alignment.seq_offset = germ_pos - anchor_pos
-            # Mutation ratio is the distance divided by the length of overlap
-            alignment.v_mutation_fraction = v_score / float(alignment.v_length)
+    def _compare_v(self, alignment, aligned_v, limit_vs, rows):
+        if limit_vs is not None:
+            # Only the germlines in limit_vs are compared
+            allowed = self._get_v_subset(limit_vs)
+            rows = self._all_v_rows[allowed] if rows is None else \
+                rows[allowed[rows]]
+        valid, dists, lengths = self.v_germlines.compare_all(
+            aligned_v, alignment.j_anchor_pos, self.MISMATCH_THRESHOLD, rows)
+        if rows is None:
+            rows = self._all_v_rows
+        return valid, dists, lengths, rows
+
+    def process_v(self, alignment, anchor_pos, limit_vs, aligned_v=None,
+                  rows=None):
+        if aligned_v is None:
+            aligned_v = VGene(alignment.sequence.sequence)
+        if rows is not None and len(rows) > 0:
+            valid, dists, lengths, rows = self._compare_v(
+                alignment, aligned_v, limit_vs, rows)
+            if not valid.any():
+                # None of the shortlisted germlines are valid
+                rows = None
+        else:
+            rows = None
+        if rows is None:
+            valid, dists, lengths, rows = self._compare_v(
+                alignment, aligned_v, limit_vs, None)
+        if not valid.any():
+            return
+
+        # Record the germlines with the lowest distance.  The length and
+        # anchor position are taken from the first in name order.
+        v_score = dists[valid].min()
+        ties = np.flatnonzero(valid & (dists == v_score))
+        alignment.v_gene = set([self.v_germlines.names[i] for i in rows[ties]])
+        alignment.v_length = int(lengths[ties[0]])
+        germ_pos = int(self.v_germlines.anchor_positions[rows[ties[0]]])
+        v_score = int(v_score)
+
+        # Determine the pad length
+        alignment.seq_offset = germ_pos - anchor_pos
+        # Mutation ratio is the distance divided by the length of overlap
+        alignment.v_mutation_fraction = v_score / float(alignment.v_length)
 
     def align_to_germline(self, alignment, avg_len=None, avg_mut=None):
         if avg_len is not None and avg_mut is not None:
@@ -219,21 +300,15 @@ class AnchorAligner(object):
             [self.v_germlines[v] for v in alignment.v_gene], cutoff=False
         )
         alignment.germline = germ[:CDR3_OFFSET]
-        # If we need to pad the sequence, do so, otherwise trim the sequence to
-        # the germline length
-        if alignment.seq_offset >= 0:
-            alignment.sequence.pad(alignment.seq_offset)
-        else:
-            alignment.sequence.remove_prefix(-alignment.seq_offset)
-        alignment.j_anchor_pos += alignment.seq_offset
-
-        # Add germline gaps to sequence before CDR3 and update anchor positions
-        for i, c in enumerate(alignment.germline):
-            if c == '-':
-                alignment.sequence.add_gap(i)
-                alignment.j_anchor_pos += 1
-                if i < alignment.seq_start:
-                    alignment.seq_offset += 1
+        # The sequence will be padded, or trimmed, to the germline length.
+        # Germline gaps before the CDR3 are added to the sequence so update
+        # the anchor positions accordingly.
+        offset = alignment.seq_offset
+        gaps = [i for i, c in enumerate(alignment.germline) if c == '-']
+        alignment.j_anchor_pos += offset + len(gaps)
+        for i in gaps:
+            if i < alignment.seq_start:
+                alignment.seq_offset += 1
 
         j_germ = get_common_seq(
             [self.j_germlines[j] for j in alignment.j_gene], right=True
@@ -243,6 +318,14 @@ class AnchorAligner(object):
             alignment.j_anchor_pos + self.j_germlines.anchor_len -
             self.j_germlines.upstream_of_cdr3 - alignment.cdr3_start
         )
+        j_germ = j_germ[-self.j_germlines.upstream_of_cdr3:]
+
+        # Build the gapped sequence to the length of the full germline; if the
+        # sequence is longer than the germline it is trimmed
+        alignment.sequence.align(
+            offset, gaps,
+            len(alignment.germline) + max(0, alignment.cdr3_num_nts) +
+            len(j_germ))
 
         v_end = alignment.seq_start + alignment.num_gaps + alignment.v_length
         v_germ = germ[CDR3_OFFSET:v_end]
@@ -260,10 +343,4 @@ class AnchorAligner(object):
         alignment.j_anchor_pos += alignment.cdr3_num_nts
         # Fill germline CDR3 with gaps
         alignment.germline += '-' * alignment.cdr3_num_nts
-        alignment.germline += j_germ[-self.j_germlines.upstream_of_cdr3:]
-        # If the sequence is longer than the germline, trim it
-        if len(alignment.sequence) > len(alignment.germline):
-            alignment.sequence.trim_right(len(alignment.germline))
-        elif len(alignment.sequence) < len(alignment.germline):
-            alignment.sequence.pad_right(len(alignment.germline) -
-                                         len(alignment.sequence))
+        alignment.germline += j_germ
@@ -0,0 +1,248 @@
+import datetime
+import json
+import multiprocessing as mp
+import os
+import platform
+import Queue
+import resource
+import shutil
+import tempfile
+import time
+
+from immunedb.common.models import Sample, Subject
+from immunedb.identification import SequenceWriter
+from immunedb.identification.genes import load_germlines
+from immunedb.identification.identify import (get_alignment_cache,
+                                              IdentificationProps,
+                                              IdentificationWorker)
+from immunedb.identification.synthetic import SyntheticRepertoire, write_fastq
+from immunedb.util.log import logger
+
+# How often, in seconds, a benchmark process is checked for having exited
+# without a result
+POLL_INTERVAL = 1
+
+# The names of the stages logged by IdentificationWorker
+STAGES = {
+    'Collapsed reads to': 'collapse',
+    'Aligned': 'align',
+    'Re-aligned': 'realign',
+    'Aligned and re-aligned': 'align_realign',
+}
+
+
+class _DiscardOutput(object):
+    # Stands in for a session or DatabaseWriter, counting the rows which
+    # would have been written
+    def __init__(self):
+        self.rows = {'sequences': 0, 'duplicates': 0, 'noresults': 0}
+
+    def bulk_save_objects(self, objects):
+        # Only NoResults are saved directly; sequences are counted by the
+        # sequence writer
+        self.rows['noresults'] += len(objects)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _DiscardSequenceWriter(SequenceWriter):
+    def _write(self, sequences):
+        self._session.rows['sequences'] += len(sequences)
+        self._session.rows['duplicates'] += sum(
+            len(duplicates) for _, duplicates in sequences)
+
+
+class _BenchmarkWorker(IdentificationWorker):
+    # Identifies a sample without a database, recording the time of each stage
+    def __init__(self, *args, **kwargs):
+        super(_BenchmarkWorker, self).__init__(*args, **kwargs)
+        self._worker_id = 1
+        self.stages = []
+
+    def _setup_sample(self, meta):
+        subject = Subject(id=1, identifier=meta['subject'])
+        return None, Sample(id=1, name=meta['sample_name'], subject=subject)
+
+    def _get_sequence_writer(self, output, sample):
+        return _DiscardSequenceWriter(output, sample)
+
+    def _set_progress(self, sample, complete):
+        pass
+
+    def _log_throughput(self, action, count, start):
+        self.stages.append((STAGES.get(action, action), count,
+                            time.time() - start))
+        super(_BenchmarkWorker, self)._log_throughput(action, count, start)
+
+
+def _get_peak_rss():
+    # ru_maxrss is in kilobytes on Linux but bytes on OS X
+    scale = 1024 * 1024 if platform.system() == 'Darwin' else 1024
+    return tuple(
+        round(resource.getrusage(who).ru_maxrss / float(scale), 1)
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+
+
+def _identify(args, v_germlines, j_germlines, path, count):
+    props = IdentificationProps(**vars(args))
+    output = _DiscardOutput()
+    worker = _BenchmarkWorker(
+        output, v_germlines, j_germlines, props, None, nproc=args.nproc,
+        dedup_memory=(args.dedup_memory * 1024 * 1024 if args.dedup_memory
+                      else None),
+        temp_dir=args.temp, stream_sample_size=args.stream_sample_size,
+        alignment_cache=get_alignment_cache(args, v_germlines, j_germlines,
+                                            props))
+    start = time.time()
+    worker.do_task({
+        'path': path,
+        'meta': {'sample_name': 'synthetic{}'.format(count),
+                 'subject': 'synthetic'}
+    })
+    # Stages which are not logged, such as estimating V-tie parameters, are
+    # included in the total
+    seconds = time.time() - start
+    # The pool is joined so its peak memory is included
+    worker.cleanup()
+
+    peak_rss, peak_children_rss = _get_peak_rss()
+    return {
+        'reads': count,
+        'unique': worker.stages[0][1],
+        'stages': {stage: round(elapsed, 3)
+                   for stage, _, elapsed in worker.stages},
+        'seconds': round(seconds, 3),
+        'reads_per_second': round(count / seconds, 1) if seconds > 0 else 0,
+        'peak_rss_mb': peak_rss,
+        'peak_children_rss_mb': peak_children_rss,
+        'rows': output.rows,
+    }
+
+
+def _run_in_process(func, *args):
+    # Each run is in its own process so its peak memory is measured alone
+    results = mp.Queue()
+
+    def run():
+        try:
+            results.put((None, func(*args)))
+        except Exception as e:
+            logger.exception('Benchmark failed')
+            results.put((str(e), None))
+
+    process = mp.Process(target=run)
+    process.start()
+    while True:
+        try:
+            error, result = results.get(timeout=POLL_INTERVAL)
+            break
+        except Queue.Empty:
+            if not process.is_alive():
+                # The process may have exited right after putting its result
+                try:
+                    error, result = results.get(timeout=POLL_INTERVAL)
+                    break
+                except Queue.Empty:
+                    raise RuntimeError(
+                        'Benchmark process exited with code {}'.format(
+                            process.exitcode))
+    process.join()
+    if error is not None:
+        raise RuntimeError(error)
+    return result
+
+
+def _get_reads(args, v_germlines, j_germlines, data_dir, count):
+    path = os.path.join(data_dir, 'synthetic_{}.fastq'.format('_'.join(
+        str(value) for value in (count, args.mutation, args.indel_rate,
+                                 args.n_rate, args.rc_rate,
+                                 args.duplicate_rate, args.seed))))
+    if os.path.exists(path):
+        logger.info('Using {}'.format(path))
+        return path, None
+
+    logger.info('Generating {} synthetic reads'.format(count))
+    start = time.time()
+    repertoire = SyntheticRepertoire(v_germlines, j_germlines,
+                                     mutation=args.mutation,
+                                     indel_rate=args.indel_rate,
+                                     n_rate=args.n_rate, rc_rate=args.rc_rate,
+                                     duplicate_rate=args.duplicate_rate,
+                                     seed=args.seed)
+    # Reads are written to a temporary name so an interrupted run is not
+    # mistaken for a complete file by later runs
+    with open(path + '.tmp', 'w') as fh:
+        write_fastq(fh, repertoire.generate(count))
+    os.rename(path + '.tmp', path)
+    return path, time.time() - start
+
+
+def _compare(results, baseline_path):
+    with open(baseline_path) as fh:
+        baseline = {r['reads']: r for r in json.load(fh)['results']}
+    for result in results:
+        previous = baseline.get(result['reads'])
+        if previous is None:
+            logger.info('No baseline for {} reads'.format(result['reads']))
+            continue
+        logger.info('{} reads: {}x the reads per second and {}x the peak '
+                    'memory of the baseline'.format(
+                        result['reads'],
+                        round(result['reads_per_second'] /
+                              previous['reads_per_second'], 2),
+                        round(result['peak_rss_mb'] /
+                              previous['peak_rss_mb'], 2)))
+        for stage, seconds in sorted(result['stages'].items()):
+            if stage in previous['stages']:
+                logger.info('\t{}: {}s (baseline {}s)'.format(
+                    stage, seconds, previous['stages'][stage]))
+
+
+def run_benchmark(args):
+    """Identifies synthetic samples of each size in ``args.reads`` without a
+    database, reporting the throughput, time of each stage, and peak memory.
+
+    """
+    v_germlines, j_germlines = load_germlines(
+        args.v_germlines, args.j_germlines, args.upstream_of_cdr3,
+        args.anchor_len, args.min_anchor_len, args.germline_cache)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(dir=args.temp)
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    results = []
+    try:
+        for count in args.reads:
+            path, generate_time = _get_reads(args, v_germlines, j_germlines,
+                                             data_dir, count)
+            result = _run_in_process(_identify, args, v_germlines,
+                                     j_germlines, path, count)
+            if generate_time is not None:
+                result['generate_seconds'] = round(generate_time, 3)
+            logger.info('{} reads ({} unique) identified in {}s, {} reads '
+                        'per second, peak memory {} MB ({} MB in '
+                        'subprocesses)'.format(
+                            count, result['unique'], result['seconds'],
+                            result['reads_per_second'], result['peak_rss_mb'],
+                            result['peak_children_rss_mb']))
+            results.append(result)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir)
+
+    if args.baseline:
+        _compare(results, args.baseline)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({
+                'date': datetime.datetime.now().isoformat(),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'cpus': mp.cpu_count(),
+                'parameters': vars(args),
+                'results': results,
+            }, fh, indent=4, sort_keys=True)
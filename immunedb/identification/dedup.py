@@ -0,0 +1,188 @@
+import heapq
+import marshal
+import os
+import random
+import shutil
+import tempfile
+
+from immunedb.identification.vdj_sequence import VDJSequence
+
+
+class UniqueSequences(object):
+    """Collapses identical reads into unique sequences.  If ``max_memory`` is
+    specified, the reads held in memory are periodically spilled to sorted run
+    files on disk which are merged once all reads have been added.
+
+    Iterating yields a :py:class:`VDJSequence` for each unique sequence in
+    sorted order with the quality of its first read and the IDs of all its
+    reads in input order.  Each sequence is yielded only once.  Spill files
+    are removed once iteration finishes, by :py:meth:`close`, or on leaving a
+    ``with`` block.
+
+    :param int max_memory: The approximate maximum number of bytes of reads
+        to hold in memory, or ``None`` for no limit
+    :param str temp_dir: The directory in which to create spill files
+    :param int sample_size: If specified, a uniform random sample of up to
+        this many unique sequences is kept as they are added and is available
+        from :py:attr:`sample`.  Sequences seen again after being spilled are
+        counted as new, so they are slightly more likely to be sampled.
+    :param int seed: The seed for choosing the sample
+
+    """
+    # Approximate bytes used by a unique sequence and by each read ID, in
+    # addition to the length of their strings
+    ENTRY_OVERHEAD = 200
+    ID_OVERHEAD = 50
+
+    def __init__(self, max_memory=None, temp_dir=None, sample_size=None,
+                 seed=0):
+        self._max_memory = max_memory
+        self._temp_dir = temp_dir
+        self._spill_dir = None
+        self._runs = []
+        self._merged = None
+        self._num_unique = None
+        self._seqs = {}
+        self._memory = 0
+        self._sample_size = sample_size
+        self._sample = []
+        self._sampled = 0
+        self._random = random.Random(seed)
+
+    def add(self, seq_id, sequence, quality=None):
+        """Adds a read.  Reads which are not valid sequences are ignored.
+
+        :param str seq_id: The ID of the read
+        :param str sequence: The nucleotides of the read
+        :param str quality: The quality string of the read, if any
+
+        """
+        vdj = self._seqs.get(sequence)
+        if vdj is None:
+            try:
+                vdj = VDJSequence(ids=[], sequence=sequence, quality=quality)
+            except ValueError:
+                return
+            self._seqs[sequence] = vdj
+            if self._sample_size is not None:
+                self._add_to_sample(sequence, quality)
+            self._memory += (self.ENTRY_OVERHEAD + len(sequence) +
+                             (len(quality) if quality else 0))
+        vdj.ids.append(seq_id)
+        self._memory += self.ID_OVERHEAD + len(seq_id)
+
+        if self._max_memory is not None and self._memory > self._max_memory:
+            self._spill()
+
+    def add_all(self, records):
+        for seq_id, sequence, quality in records:
+            self.add(seq_id, sequence, quality)
+        return self
+
+    @property
+    def sample(self):
+        """A list of :py:class:`VDJSequence` instances, without IDs, for the
+        sampled unique sequences
+
+        """
+        return [VDJSequence([], sequence, quality)
+                for sequence, quality in self._sample]
+
+    @property
+    def spilled(self):
+        """If any reads were spilled to disk"""
+        return len(self._runs) > 0
+
+    def __len__(self):
+        if self.spilled:
+            self._merge()
+            return self._num_unique
+        return len(self._seqs)
+
+    def __iter__(self):
+        if not self.spilled:
+            for sequence in sorted(self._seqs):
+                yield self._seqs.pop(sequence)
+            self._memory = 0
+            return
+
+        self._merge()
+        try:
+            with open(self._merged, 'rb') as fh:
+                for _ in range(self._num_unique):
+                    sequence, quality, ids = marshal.load(fh)
+                    yield VDJSequence(ids, sequence, quality)
+        finally:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Removes any spill files"""
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    def _add_to_sample(self, sequence, quality):
+        # Reservoir sampling: the n-th sequence replaces a random member of a
+        # full sample with probability sample_size / n
+        self._sampled += 1
+        if len(self._sample) < self._sample_size:
+            self._sample.append((sequence, quality))
+        else:
+            index = self._random.randrange(self._sampled)
+            if index < self._sample_size:
+                self._sample[index] = (sequence, quality)
+
+    def _spill(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix='immunedb_dedup_',
+                                               dir=self._temp_dir)
+        path = os.path.join(self._spill_dir, 'run_{}'.format(len(self._runs)))
+        with open(path, 'wb') as fh:
+            for sequence in sorted(self._seqs):
+                vdj = self._seqs.pop(sequence)
+                marshal.dump((sequence, vdj.quality, vdj.ids), fh)
+        self._runs.append(path)
+        self._memory = 0
+
+    def _read_run(self, index):
+        # The run index breaks ties between identical sequences so reads are
+        # merged in input order
+        with open(self._runs[index], 'rb') as fh:
+            while True:
+                try:
+                    sequence, quality, ids = marshal.load(fh)
+                except EOFError:
+                    break
+                yield sequence, index, quality, ids
+
+    def _merge(self):
+        if self._merged is not None:
+            return
+        if len(self._seqs) > 0:
+            self._spill()
+
+        self._merged = os.path.join(self._spill_dir, 'merged')
+        self._num_unique = 0
+        with open(self._merged, 'wb') as fh:
+            current = None
+            for sequence, _, quality, ids in heapq.merge(
+                    *[self._read_run(i) for i in range(len(self._runs))]):
+                if current is not None and current[0] == sequence:
+                    current[2].extend(ids)
+                    continue
+                if current is not None:
+                    marshal.dump(current, fh)
+                    self._num_unique += 1
+                current = (sequence, quality, ids)
+            if current is not None:
+                marshal.dump(current, fh)
+                self._num_unique += 1
+
+        for path in self._runs:
+            os.remove(path)
@@ -1,11 +1,16 @@
+import cPickle as pickle
 import dnautils
+import hashlib
+import numpy as np
+import os
 import re
+import tempfile
 
 from Bio import SeqIO
 from Bio.Seq import Seq
 
 from immunedb.common.models import CDR3_OFFSET
-from immunedb.util.hyper import hypergeom
+from immunedb.util.hyper import hypergeom_table
 from immunedb.identification import AlignmentException, get_common_seq
 from immunedb.util.funcs import find_streak_position
 
@@ -44,11 +49,13 @@ class GeneName(object):
 
 class GeneTies(dict):
     TIES_PROB_THRESHOLD = 0.01
+    MUTATION_BUCKETS = (.05, .15, .30)
 
     def __init__(self, genes, remove_gaps=True):
         self.ties = {}
         self.hypers = {}
         self.remove_gaps = remove_gaps
+        self._tie_seqs = None
 
         self.update(genes)
 
@@ -88,13 +95,17 @@ class GeneTies(dict):
             return set([gene])
 
         if gene not in self.ties[key]:
+            if self._tie_seqs is None:
+                self._tie_seqs = [
+                    (name, v.replace('-', '') if self.remove_gaps else v)
+                    for name, v in sorted(self.iteritems())
+                ]
             s_1 = (
                 self[gene].replace('-', '') if self.remove_gaps else self[gene]
             )
             self.ties[key][gene] = set([gene])
 
-            for name, v in sorted(self.iteritems()):
-                s_2 = v.replace('-', '') if self.remove_gaps else v
+            for name, s_2 in self._tie_seqs:
                 K = dnautils.hamming(s_1[-length:], s_2[-length:])
                 p = self._hypergeom(length, mutation, K)
                 if p >= self.TIES_PROB_THRESHOLD:
@@ -103,11 +114,23 @@ class GeneTies(dict):
 
         return self.ties[key][gene]
 
+    def precompute_ties(self, lengths):
+        """Computes the ties of every gene for each of ``lengths`` in each
+        mutation bucket so they need not be computed lazily.
+
+        :param list lengths: The tie lengths to compute
+
+        """
+        for length in lengths:
+            for mutation in self.MUTATION_BUCKETS:
+                for gene in self:
+                    GeneTies.get_single_tie(self, gene, length, mutation)
+
     def _hypergeom(self, length, mutation, K):
-        key = (length, mutation, K)
+        key = (length, mutation)
         if key not in self.hypers:
-            self.hypers[key] = hypergeom(length, mutation, K)
-        return self.hypers[key]
+            self.hypers[key] = hypergeom_table(length, mutation)
+        return self.hypers[key][K]
 
     def mut_bucket(self, mut):
         if 0 <= mut <= .05:
@@ -124,8 +147,12 @@ class GeneTies(dict):
 
 
 class VGermlines(GeneTies):
+    LENGTH_BUCKETS = (100, 150, 200, 300)
+    KMER_SIZE = 7
+
     def __init__(self, path_to_germlines):
         self._min_length = None
+        self._kmer_indexes = {}
         self.alignments = {}
 
         with open(path_to_germlines) as fh:
@@ -144,12 +171,139 @@ class VGermlines(GeneTies):
                     continue
 
         super(VGermlines, self).__init__({k: v for k, v in self.iteritems()})
+        self._build_matrix()
+
+    def _build_matrix(self):
+        # Ungapped germlines, sorted by name, as rows of a zero-padded matrix
+        # where each germline is shifted so all anchors are in the same column
+        self.names = sorted(self.alignments.keys())
+        ungapped = [self.alignments[name].sequence_ungapped
+                    for name in self.names]
+        self.anchor_positions = np.array(
+            [self.alignments[name].ungapped_anchor_pos
+             for name in self.names], dtype=np.int64)
+        self._lengths = np.array([len(seq) for seq in ungapped],
+                                 dtype=np.int64)
+        self._anchor_col = max(self.anchor_positions.tolist() or [0])
+        self._matrix = np.zeros(
+            (len(ungapped), max((self._lengths - self.anchor_positions +
+                                 self._anchor_col).tolist() or [0])),
+            dtype=np.uint8)
+        for i, seq in enumerate(ungapped):
+            offset = self._anchor_col - self.anchor_positions[i]
+            self._matrix[i, offset:offset + len(seq)] = np.frombuffer(
+                seq, dtype=np.uint8)
+
+    def get_kmer_index(self, k=KMER_SIZE):
+        """Gets a :py:class:`VKmerIndex` of the germlines, building it the
+        first time it is requested.
+
+        :param int k: The length of k-mers to index
+
+        :returns: The index of germline k-mers
+        :rtype: VKmerIndex
+
+        """
+        if k not in self._kmer_indexes:
+            self._kmer_indexes[k] = VKmerIndex(
+                self.names,
+                [self.alignments[name].sequence_ungapped
+                 for name in self.names],
+                k)
+        return self._kmer_indexes[k]
+
+    def compare_all(self, other_v, max_extent, max_streak, rows=None):
+        """Compares ``other_v`` to every germline at once.  This is
+        equivalent to calling :py:meth:`VGene.compare` on each germline in
+        ``names`` order.
+
+        :param VGene other_v: The gene to compare
+        :param int max_extent: The maximum extent of the comparison after
+            aligning the anchors
+        :param int max_streak: The number of consecutive mismatches in the
+            CDR3 which ends the V
+        :param ndarray rows: If specified, the increasing indices in
+            ``names`` of the only germlines to compare
+
+        :returns: A tuple ``(valid, dists, lengths)`` of arrays with a row for
+            each germline, or each of ``rows``.  ``valid`` is ``False`` for
+            germlines where :py:meth:`VGene.compare` would raise an exception.
+        :rtype: tuple
+
+        """
+        if rows is None:
+            matrix = self._matrix
+            anchor_positions = self.anchor_positions
+            germ_lengths = self._lengths
+        else:
+            matrix = self._matrix[rows]
+            anchor_positions = self.anchor_positions[rows]
+            germ_lengths = self._lengths[rows]
+        seq = other_v.sequence_ungapped
+        anchor = other_v.ungapped_anchor_pos
+
+        # Work in the coordinates of ``other_v`` where each germline is
+        # shifted by ``delta`` and the CDR3 starts at ``anchor``.  The
+        # comparison of each germline spans ``[start, end)``.
+        delta = anchor_positions - anchor
+        start = np.maximum(-delta, 0)
+        germ_end = start + np.clip(
+            germ_lengths - np.maximum(delta, 0), 0, max_extent)
+        seq_end = start + np.clip(len(seq) - start, 0, max_extent)
+        cdr3_end = np.minimum(germ_end, seq_end)
+        valid = cdr3_end > anchor
+        if not valid.any():
+            return valid, cdr3_end, cdr3_end
+
+        # Only the columns which may be compared with any germline are used
+        col_offset = self._anchor_col - anchor
+        lo = max(0, -col_offset, start.min())
+        hi = min(len(seq), matrix.shape[1] - col_offset,
+                 cdr3_end[valid].max())
+        if hi - lo < max_streak:
+            hi = lo + max_streak
+        germ = matrix[:, lo + col_offset:hi + col_offset]
+        seq = np.frombuffer(seq, dtype=np.uint8)[lo:hi]
+        if germ.shape[1] < hi - lo or len(seq) < hi - lo:
+            # The window extends past the germlines or sequence; pad it
+            width = hi - lo
+            germ = np.pad(germ, ((0, 0), (0, width - germ.shape[1])),
+                          'constant')
+            seq = np.pad(seq, (0, width - len(seq)), 'constant')
+        cols = np.arange(lo, hi)[np.newaxis, :]
+        mismatches = germ != seq
+
+        # Find the first streak of mismatches in the CDR3 of each row.  The
+        # V ends before the first mismatch of the streak.
+        streaks = mismatches[:, max_streak - 1:].copy()
+        for i in range(1, max_streak):
+            streaks &= mismatches[:, max_streak - 1 - i:hi - lo - i]
+        streak_cols = cols[:, :streaks.shape[1]]
+        streaks &= ((streak_cols >= anchor) &
+                    (streak_cols < (cdr3_end - max_streak + 1)[:, np.newaxis]))
+        has_streak = streaks.any(axis=1)
+        end = np.where(has_streak, streaks.argmax(axis=1) + lo - 1, cdr3_end)
+
+        # Mismatches where neither nucleotide is an N are counted
+        mismatches &= germ != ord('N')
+        mismatches &= (seq != ord('N'))[np.newaxis, :]
+        mismatches &= cols >= start[:, np.newaxis]
+        mismatches &= cols < end[:, np.newaxis]
+        dists = np.count_nonzero(mismatches, axis=1)
+        lengths = end - start
+        valid &= lengths > 0
+        return valid, dists, lengths
 
     def get_single_tie(self, gene, length, mutation):
         return super(VGermlines, self).get_single_tie(
             gene, min(self.length_bucket(length), self._min_length), mutation
         )
 
+    def precompute_ties(self):
+        super(VGermlines, self).precompute_ties(sorted(set(
+            min(length, self._min_length) for length in self.LENGTH_BUCKETS
+        )))
+
     def length_bucket(self, length):
         if 0 < length <= 100:
             return 100
@@ -160,12 +314,108 @@ class VGermlines(GeneTies):
         return 300
 
 
+# Maps nucleotides to their 2-bit codes; all other characters map to -1
+_KMER_CODES = np.full(256, -1, dtype=np.int64)
+for _code, _nt in enumerate('ACGT'):
+    _KMER_CODES[ord(_nt)] = _code
+
+
+def _get_kmers(sequence, k):
+    # The k-mers of ``sequence`` without N or gaps, encoded as integers
+    codes = _KMER_CODES[np.frombuffer(sequence, dtype=np.uint8)]
+    num_kmers = len(codes) - k + 1
+    if num_kmers <= 0:
+        return np.zeros(0, dtype=np.int64)
+    kmers = codes[:num_kmers].copy()
+    for i in range(1, k):
+        kmers <<= 2
+        kmers |= codes[i:i + num_kmers]
+    # Exclude k-mers with any invalid characters
+    invalid = np.concatenate(([0], np.cumsum(codes < 0)))
+    return kmers[invalid[k:] == invalid[:-k]]
+
+
+def get_kmer_presence(sequences, k):
+    """Gets which k-mers occur in any of ``sequences``.
+
+    :param list sequences: The ungapped sequences
+    :param int k: The length of k-mers
+
+    :returns: An array where element ``i`` is 1 if the k-mer encoded as ``i``
+        occurs in a sequence and 0 otherwise
+    :rtype: ndarray
+
+    """
+    presence = np.zeros(4 ** k, dtype=np.uint8)
+    for sequence in sequences:
+        presence[_get_kmers(sequence, k)] = 1
+    return presence
+
+
+class VKmerIndex(object):
+    """An index of the k-mers in V germlines used to shortlist the germlines
+    which are likely to be the closest to a sequence.
+
+    :param list names: The names of the germlines
+    :param list sequences: The ungapped sequences of the germlines in the
+        same order as ``names``
+    :param int k: The length of k-mers to index
+
+    """
+    def __init__(self, names, sequences, k):
+        self.k = k
+        # The germlines containing k-mer ``i`` are
+        # ``_rows[_offsets[i]:_offsets[i + 1]]``
+        kmer_rows = [[] for _ in range(4 ** k)]
+        for i, sequence in enumerate(sequences):
+            for kmer in np.unique(_get_kmers(sequence, k)):
+                kmer_rows[kmer].append(i)
+        self._offsets = np.zeros(4 ** k + 1, dtype=np.int64)
+        self._offsets[1:] = np.cumsum([len(rows) for rows in kmer_rows])
+        self._rows = np.array([i for rows in kmer_rows for i in rows],
+                              dtype=np.int64)
+        base_ids = {}
+        self._bases = np.array([base_ids.setdefault(name.base, len(base_ids))
+                                for name in names], dtype=np.int64)
+        self._num_bases = len(base_ids)
+
+    def shortlist(self, sequence, size):
+        """Gets the germlines which share the most k-mers with ``sequence``.
+        Germlines tied with the ``size``-th are included, as are all alleles
+        of each included gene so that allele ties are preserved.
+
+        :param str sequence: The ungapped sequence
+        :param int size: The number of germlines to shortlist before adding
+            ties and alleles
+
+        :returns: The increasing indices of the shortlisted germlines, which
+            is empty if no germline shares a k-mer with ``sequence``
+        :rtype: ndarray
+
+        """
+        counts = np.frombuffer(
+            dnautils.kmer_counts(sequence, self.k, self._offsets, self._rows,
+                                 len(self._bases)),
+            dtype=np.int64)
+
+        threshold = 1
+        if size < len(counts):
+            threshold = max(threshold, np.partition(counts, -size)[-size])
+        top = np.bincount(self._bases[counts >= threshold],
+                          minlength=self._num_bases)
+        return np.flatnonzero(top[self._bases])
+
+
 class VGene(object):
-    def __init__(self, gapped_sequence):
+    def __init__(self, gapped_sequence, ungapped_anchor_pos=None):
         self._gapped_seq = str(gapped_sequence).upper()
         if self._gapped_seq[CDR3_OFFSET:].count('-') > 0:
             raise AlignmentException('Cannot have gaps after CDR3 start '
                                      '(position {})'.format(CDR3_OFFSET))
+        if ungapped_anchor_pos is not None:
+            # The caller already found the first anchor
+            self._ungapped_anchor_pos = ungapped_anchor_pos
+            return
         try:
             self._ungapped_anchor_pos = find_v_position(
                 self.sequence_ungapped).next()
@@ -242,29 +492,114 @@ class VGene(object):
         return dist, len(other_seq)
 
 
+# The translation of every codon of A, C, G, T, and N.  Codons with other
+# characters are translated by Biopython.
+CODON_TABLE = {
+    codon: str(Seq(codon).translate())
+    for codon in (a + b + c for a in 'ACGTN' for b in 'ACGTN' for c in 'ACGTN')
+}
+
+# The motifs which end the V gene in order of precedence: DxxxyzC where yz is
+# YY, YC, or YH, then YYC, YCC, or YHC, then DxxxxxC
+V_MOTIFS = [re.compile(motif) for motif in (
+    'D(.{3}((YY)|(YC)|(YH)))C',
+    'Y([YHC])C',
+    'D(.{5})C',
+)]
+
+
+def translate_frame(sequence, shift):
+    """Translates ``sequence`` starting at ``shift``, ignoring any trailing
+    partial codon.
+
+    :param str sequence: The nucleotide sequence
+    :param int shift: The offset of the first codon
+
+    :returns: The amino-acid sequence
+    :rtype: str
+
+    """
+    end = len(sequence) - (len(sequence) - shift) % 3
+    try:
+        return ''.join([CODON_TABLE[sequence[i:i + 3]]
+                        for i in xrange(shift, end, 3)])
+    except KeyError:
+        return str(Seq(sequence[shift:end]).translate())
+
+
 def find_v_position(sequence):
     '''Tries to find the end of the V gene region'''
-    if type(sequence) == str:
-        sequence = Seq(sequence)
-    # Try to find DxxxyzC
-    for found in _find_with_frameshifts(sequence, 'D(.{3}((YY)|(YC)|(YH)))C'):
-        yield found
-    # Try to find 'YYC', 'YCC', or 'YHC'
-    for found in _find_with_frameshifts(sequence, 'Y([YHC])C'):
-        yield found
-    # Try to find 'DxxxxxC'
-    for found in _find_with_frameshifts(sequence, 'D(.{5})C'):
-        yield found
-
-
-def _find_with_frameshifts(sequence, regex):
-    for shift in [2, 1, 0]:
-        seq = sequence[shift:]
-        seq = seq[:len(seq) - len(seq) % 3]
-        aas = str(seq.translate())
-        res = re.search(regex, aas)
-        if res is not None:
-            yield (res.end() - 1) * 3 + shift
+    sequence = str(sequence)
+    # Each frame is translated at most once and only if it is searched
+    frames = [None, None, None]
+    for motif in V_MOTIFS:
+        for shift in [2, 1, 0]:
+            if frames[shift] is None:
+                frames[shift] = translate_frame(sequence, shift)
+            res = motif.search(frames[shift])
+            if res is not None:
+                yield (res.end() - 1) * 3 + shift
+
+
+class JAnchorIndex(object):
+    """An index of J anchors in order of precedence, built once so that
+    finding the anchor in a sequence requires only native string and regex
+    scans.  Duplicate anchors are removed and each anchor is compiled to a
+    pattern which treats N as matching any nucleotide.
+
+    :param list anchors: A list of ``(anchor, gene)`` tuples in order of
+        precedence
+
+    """
+    def __init__(self, anchors):
+        self.anchors = []
+        self._wildcards = []
+        self._has_n = []
+        for anchor, gene in anchors:
+            if anchor in self.anchors:
+                continue
+            self.anchors.append(anchor)
+            self._wildcards.append(re.compile(''.join(
+                '.' if c == 'N' else '[{}N]'.format(c) for c in anchor
+            )))
+            self._has_n.append('N' in anchor)
+
+    def find(self, sequence, rc=None):
+        """Finds the first anchor in order of precedence which matches
+        ``sequence`` or its reverse complement ``rc``.  For each anchor, the
+        rightmost exact match is tried on each strand, followed by the
+        leftmost match allowing Ns (excluding the final position).
+
+        :param str sequence: The sequence to search
+        :param str rc: The reverse complement of ``sequence``, or ``None`` to
+            search only ``sequence``
+
+        :returns: A tuple ``(anchor, position, is_rc)`` or ``None`` if no
+            anchor matches
+
+        """
+        # Without an N in the sequence or anchor, a match allowing Ns is an
+        # exact match so the pattern need not be tried.
+        check_ns = 'N' in sequence
+        for i, anchor in enumerate(self.anchors):
+            pos = sequence.rfind(anchor)
+            if pos >= 0:
+                return anchor, pos, False
+            if rc is not None:
+                pos = rc.rfind(anchor)
+                if pos >= 0:
+                    return anchor, pos, True
+
+            if check_ns or self._has_n[i]:
+                match = self._wildcards[i].search(sequence, 0,
+                                                  len(sequence) - 1)
+                if match is not None:
+                    return anchor, match.start(), False
+                if rc is not None:
+                    match = self._wildcards[i].search(rc, 0, len(rc) - 1)
+                    if match is not None:
+                        return anchor, match.start(), True
+        return None
 
 
 class JGermlines(GeneTies):
@@ -282,6 +617,7 @@ class JGermlines(GeneTies):
         self._anchor_len = anchor_len
         self._min_anchor_len = min_anchor_len
         self._min_length = None
+        self._single_ties = {}
 
         with open(path_to_germlines) as fh:
             for record in SeqIO.parse(fh, 'fasta'):
@@ -295,6 +631,7 @@ class JGermlines(GeneTies):
         self._anchors = {name: seq[-anchor_len:] for name, seq in
                          self.iteritems()}
         super(JGermlines, self).__init__({k: v for k, v in self.iteritems()})
+        self._anchor_index = JAnchorIndex(self.get_all_anchors())
 
     @property
     def upstream_of_cdr3(self):
@@ -324,7 +661,22 @@ class JGermlines(GeneTies):
                 if len(trimmed_seq) >= self._min_anchor_len:
                     yield trimmed_seq, j
 
+    def get_anchor_index(self, allowed_genes=None):
+        """Gets a :py:class:`JAnchorIndex` of the anchors from
+        :py:meth:`get_all_anchors`.
+
+        :param list allowed_genes: If specified, only anchors from genes with
+            these names are included
+
+        """
+        if allowed_genes is None:
+            return self._anchor_index
+        return JAnchorIndex(self.get_all_anchors(allowed_genes))
+
     def get_single_tie(self, gene, length, mutation):
+        # J ties do not depend on the length or mutation
+        if gene in self._single_ties:
+            return self._single_ties[gene]
         seq = self[gene][-self.anchor_len:]
         tied = self.all_alleles(set([gene]))
         for j, other_seq in sorted(self.iteritems()):
@@ -333,8 +685,13 @@ class JGermlines(GeneTies):
                 tied.add(j)
             elif dnautils.hamming(other_seq, seq) == 0:
                 tied.add(j)
+        self._single_ties[gene] = tied
         return tied
 
+    def precompute_ties(self):
+        for gene in self:
+            self.get_single_tie(gene, None, None)
+
     def all_ties(self, length, mutation):
         ties = {}
         for name in self:
@@ -344,3 +701,73 @@ class JGermlines(GeneTies):
                     [self[n] for n in tie_name], right=True
                 )
         return ties
+
+
+# Incremented when the pickled germline classes change incompatibly
+GERMLINE_CACHE_VERSION = 3
+
+
+def load_germlines(v_path, j_path,
+                   upstream_of_cdr3=JGermlines.defaults['upstream_of_cdr3'],
+                   anchor_len=JGermlines.defaults['anchor_len'],
+                   min_anchor_len=JGermlines.defaults['min_anchor_len'],
+                   cache_dir=None):
+    """Loads V and J germlines.  If ``cache_dir`` is specified, the parsed
+    germlines along with all of their ties are saved to a file in that
+    directory keyed by the contents of the germline files and the J anchor
+    parameters.  Later calls with the same parameters load that file rather
+    than parsing the germlines and computing ties again.
+
+    :param str v_path: Path to the FASTA file of IMGT gapped V germlines
+    :param str j_path: Path to the FASTA file of J germlines
+    :param int upstream_of_cdr3: The number of nucleotides in the J germlines
+        upstream of the CDR3
+    :param int anchor_len: The number of nucleotides at the end of the J
+        germlines to use as anchors
+    :param int min_anchor_len: The minimum number of nucleotides in the J
+        germline anchors required to match
+    :param str cache_dir: The directory in which to store compiled
+        germlines, or ``None`` to disable caching
+
+    :returns: A tuple ``(v_germlines, j_germlines)``
+    :rtype: tuple
+
+    """
+    def load():
+        return (VGermlines(v_path),
+                JGermlines(j_path, upstream_of_cdr3, anchor_len,
+                           min_anchor_len))
+
+    if cache_dir is None:
+        return load()
+
+    key = hashlib.sha1()
+    for path in (v_path, j_path):
+        with open(path, 'rb') as fh:
+            key.update(hashlib.sha1(fh.read()).hexdigest())
+    key.update(str((upstream_of_cdr3, anchor_len, min_anchor_len,
+                    GERMLINE_CACHE_VERSION)))
+    cache_path = os.path.join(cache_dir,
+                              'germlines_{}.pickle'.format(key.hexdigest()))
+
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'rb') as fh:
+                return pickle.load(fh)
+        except Exception:
+            # The cache is unreadable; it will be replaced below
+            pass
+
+    germlines = load()
+    for genes in germlines:
+        genes.precompute_ties()
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # Write to a temporary file first so concurrent processes never read a
+    # partially written cache
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fh:
+        pickle.dump(germlines, fh, pickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, cache_path)
+    return germlines
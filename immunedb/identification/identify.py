@@ -1,21 +1,26 @@
+import hashlib
 import multiprocessing as mp
 import os
+import time
 import traceback
 
-from Bio import SeqIO
-
 import immunedb.common.config as config
 import immunedb.common.modification_log as mod_log
-from immunedb.common.models import Sample, Study, Subject
+from immunedb.common.models import (IdentificationProgress, Sample, Study,
+                                    Subject)
 from immunedb.identification import (add_as_noresult, add_uniques,
-                                     AlignmentException)
+                                     AlignmentException, realign_to_ties,
+                                     rollback_sample, SequenceWriter)
+from immunedb.identification.alignment_cache import AlignmentCache
 from immunedb.identification.anchor import AnchorAligner
+from immunedb.identification.dedup import UniqueSequences
 from immunedb.identification.metadata import parse_metadata, MetadataException
-from immunedb.identification.vdj_sequence import VDJSequence
-from immunedb.identification.genes import JGermlines, VGermlines
+from immunedb.identification.genes import load_germlines
+from immunedb.identification.writer import DatabaseWriter
 import immunedb.util.concurrent as concurrent
 import immunedb.util.funcs as funcs
 from immunedb.util.log import logger
+from immunedb.util.reader import read_sequences
 
 
 class IdentificationProps(object):
@@ -27,6 +32,9 @@ class IdentificationProps(object):
         'allow_cross_family': False,
         'max_insertions': 5,
         'max_deletions': 5,
+        'v_prefilter': None,
+        'min_germline_kmers': None,
+        'j_fallback_max_distance': None,
     }
 
     def __init__(self, **kwargs):
@@ -86,88 +94,460 @@ class IdentificationProps(object):
                 alignment.cdr3_num_nts))
 
 
+def _get_alignment(aligner, vdj, cache):
+    if cache is not None:
+        return cache.get_alignment(aligner, vdj)
+    return aligner.get_alignment(vdj)
+
+
+def align_sequence(aligner, vdj, cache=None):
+    """Aligns a single unique sequence, capturing any failure so the result
+    can be returned from a subprocess.
+
+    :param AnchorAligner aligner: The aligner to use
+    :param VDJSequence vdj: The sequence to align
+    :param AlignmentCache cache: If specified, the cache consulted before
+        aligning the sequence
+
+    :returns: A tuple ``(vdj, alignment, reason, error)`` where ``alignment``
+        is ``None`` if the sequence could not be aligned, ``reason`` is the
+        reason it was not aligned, and ``error`` is a traceback for any
+        unexpected error
+
+    """
+    try:
+        return vdj, _get_alignment(aligner, vdj, cache), None, None
+    except AlignmentException as e:
+        return vdj, None, str(e), None
+    except Exception:
+        return vdj, None, None, traceback.format_exc()
+
+
+def realign_sequence(aligner, props, alignment, avg_len, avg_mut):
+    """Re-aligns an alignment to its V-ties, capturing any failure in the same
+    manner as :py:func:`align_sequence`.
+
+    """
+    try:
+        realign_to_ties(alignment, props, aligner, avg_len, avg_mut)
+        return alignment.sequence, alignment, None, None
+    except AlignmentException as e:
+        return alignment.sequence, None, str(e), None
+    except Exception:
+        return alignment.sequence, None, None, traceback.format_exc()
+
+
+def stream_sequence(aligner, props, vdj, avg_len, avg_mut, cache=None):
+    """Aligns a single unique sequence, re-aligns it to its V-ties, and
+    validates it, capturing any failure in the same manner as
+    :py:func:`align_sequence`.  Only the initial alignment is cached.
+
+    :returns: A tuple ``(vdj, alignment, reason, error, initial)`` where the
+        first four are as in :py:func:`align_sequence` and ``initial`` is
+        ``(key, v_length, v_mutation_fraction)`` of the alignment before it
+        was re-aligned, where ``key`` is a digest of the aligned sequence, or
+        ``None`` if the sequence could not be aligned
+
+    """
+    initial = None
+    try:
+        alignment = _get_alignment(aligner, vdj, cache)
+        initial = (hashlib.sha1(alignment.sequence.sequence).digest(),
+                   alignment.v_length, alignment.v_mutation_fraction)
+        realign_to_ties(alignment, props, aligner, avg_len, avg_mut)
+        props.validate(alignment)
+        return vdj, alignment, None, None, initial
+    except AlignmentException as e:
+        return vdj, None, str(e), None, initial
+    except Exception:
+        return vdj, None, None, traceback.format_exc(), initial
+
+
+def _average_ties(alignments):
+    avg_len = (
+        sum([v.v_length for v in alignments]) / float(len(alignments)))
+    avg_mut = (
+        sum([v.v_mutation_fraction for v in alignments]) /
+        float(len(alignments))
+    )
+    return avg_len, avg_mut
+
+
+def _get_aligner(v_germlines, j_germlines, props):
+    return AnchorAligner(v_germlines, j_germlines, props.v_prefilter,
+                         props.min_germline_kmers,
+                         props.j_fallback_max_distance)
+
+
+# State for pool processes used to align a single sample across multiple
+# processes.  It is populated before work begins and inherited by each process.
+_pool_state = {}
+
+
+def _init_pool(v_germlines, j_germlines, props, alignment_cache):
+    _pool_state['aligner'] = _get_aligner(v_germlines, j_germlines, props)
+    _pool_state['props'] = props
+    _pool_state['cache'] = alignment_cache
+
+
+def _pool_align(vdj):
+    return align_sequence(_pool_state['aligner'], vdj, _pool_state['cache'])
+
+
+def _pool_realign(args):
+    alignment, avg_len, avg_mut = args
+    return realign_sequence(_pool_state['aligner'], _pool_state['props'],
+                            alignment, avg_len, avg_mut)
+
+
+def _pool_stream(args):
+    vdj, avg_len, avg_mut = args
+    return stream_sequence(_pool_state['aligner'], _pool_state['props'],
+                           vdj, avg_len, avg_mut, _pool_state['cache'])
+
+
 class IdentificationWorker(concurrent.Worker):
-    def __init__(self, session, v_germlines, j_germlines, props, sync_lock):
+    """Identifies the sequences in a sample.
+
+    :param Session session: The database session
+    :param VGermlines v_germlines: The V germlines
+    :param JGermlines j_germlines: The J germlines
+    :param IdentificationProps props: Properties for validating sequences
+    :param Lock sync_lock: A lock for creating studies, subjects, and samples
+    :param int nproc: If greater than one, the unique sequences of each
+        sample are split into chunks and aligned across ``nproc`` processes
+    :param int dedup_memory: The approximate number of bytes of reads to hold
+        in memory while collapsing identical reads before spilling them to
+        disk, or ``None`` for no limit
+    :param str temp_dir: The directory in which to create spill files
+    :param str db_config: If specified, results are written by a separate
+        process connected with this database configuration so that writes
+        overlap with alignment.  Otherwise results are written with
+        ``session``.
+    :param int stream_sample_size: If specified, the V-tie parameters of
+        each sample are estimated from a random sample of this many of its
+        unique sequences.  Every sequence is then aligned, re-aligned to its
+        V-ties, and written as it is aligned rather than holding all
+        alignments in memory.  Sequences which align identically or differ
+        only by Ns are not collapsed within the sample, which is left to the
+        collapse step.
+    :param AlignmentCache alignment_cache: If specified, the cache of
+        initial alignments consulted before aligning each sequence.  It
+        should not be shared with other workers so its statistics are only
+        those of this worker.
+
+    """
+    CHUNKS_PER_PROC = 4
+    MAX_CHUNK_SIZE = 1000
+
+    def __init__(self, session, v_germlines, j_germlines, props, sync_lock,
+                 nproc=1, dedup_memory=None, temp_dir=None, db_config=None,
+                 stream_sample_size=None, alignment_cache=None):
         self._session = session
         self._v_germlines = v_germlines
         self._j_germlines = j_germlines
         self._props = props
         self._sync_lock = sync_lock
+        self._nproc = nproc
+        self._dedup_memory = dedup_memory
+        self._temp_dir = temp_dir
+        self._db_config = db_config
+        self._stream_sample_size = stream_sample_size
+        self._alignment_cache = alignment_cache
+        self._pool = None
+        self._writer = None
 
     def do_task(self, args):
         meta = args['meta']
         self.info('Starting sample {}'.format(meta['sample_name']))
         study, sample = self._setup_sample(meta)
+        self._set_progress(sample, False)
+        # Results are written with the writer process if there is one
+        output = self._get_writer() if self._db_config else self._session
+        try:
+            self._identify_sample(sample, output, args['path'])
+        except Exception:
+            self._session.rollback()
+            if self._writer is not None:
+                # Results of this sample which are unsent or unwritten are
+                # discarded so any error writing them is reported here rather
+                # than by the next sample
+                error = self._writer.reset()
+                if error is not None:
+                    self.error('\tError writing sample {}:\n{}'.format(
+                        sample.name, error))
+            raise
+        self._session.commit()
+        # Only once everything is committed is the sample complete
+        self._set_progress(sample, True)
+        self.info('Completed sample {}'.format(sample.name))
 
-        vdjs = {}
-        parser = SeqIO.parse(args['path'], 'fasta' if
-                             args['path'].endswith('.fasta') else 'fastq')
-
-        # Collapse identical sequences
+    def _identify_sample(self, sample, output, path):
+        # Collapse identical sequences.  Any reads spilled to disk are removed
+        # even if identification fails.
         self.info('\tCollapsing identical sequences')
-        for record in parser:
-            try:
-                seq = str(record.seq)
-                if seq not in vdjs:
-                    vdjs[seq] = VDJSequence(
-                        ids=[],
-                        sequence=seq,
-                        quality=funcs.ord_to_quality(
-                            record.letter_annotations.get('phred_quality')
-                        )
-                    )
-                vdjs[seq].ids.append(record.description)
-            except ValueError:
-                continue
-
+        start = time.time()
+        with UniqueSequences(self._dedup_memory, self._temp_dir,
+                             sample_size=self._stream_sample_size) as vdjs:
+            vdjs.add_all(read_sequences(path))
+            if vdjs.spilled:
+                self.info('\tMerging reads spilled to disk')
+            num_unique = len(vdjs)
+            self._log_throughput('Collapsed reads to', num_unique, start)
+
+            aligner = _get_aligner(self._v_germlines, self._j_germlines,
+                                   self._props)
+            self._rejected = {'unique': 0, 'reads': 0}
+            estimate = None
+            if self._stream_sample_size:
+                estimate = self._estimate_ties(aligner, vdjs.sample)
+                if estimate is None:
+                    self.info('\tNo sampled sequences aligned; aligning in '
+                              'two passes')
+
+            if estimate is not None:
+                self._identify_streaming(sample, output, aligner, vdjs,
+                                         num_unique, *estimate)
+            else:
+                self._identify_two_pass(sample, output, aligner, vdjs,
+                                        num_unique)
+
+        if self._props.min_germline_kmers:
+            self.info('\tRejected {} unique sequences ({} reads) sharing '
+                      'fewer than {} k-mers with the germlines'.format(
+                          self._rejected['unique'], self._rejected['reads'],
+                          self._props.min_germline_kmers))
+        if self._alignment_cache is not None:
+            self._log_cache_stats(self._alignment_cache.get_stats())
+        if self._db_config:
+            self._log_writer_stats(output.sync())
+
+    def _identify_two_pass(self, sample, output, aligner, vdjs, num_unique):
         alignments = {}
-        aligner = AnchorAligner(self._v_germlines, self._j_germlines)
-        self.info('\tAligning {} unique sequences'.format(len(vdjs)))
-        # Attempt to align all unique sequences
-        for sequence in funcs.periodic_commit(self._session,
-                                              sorted(vdjs.keys())):
-            vdj = vdjs[sequence]
-            del vdjs[sequence]
-            try:
+        self.info('\tAligning {} unique sequences{}'.format(
+            num_unique, self._proc_message()))
+        start = time.time()
+        # Attempt to align all unique sequences in sorted order
+        if self._nproc > 1:
+            results = self._get_pool().imap(_pool_align, vdjs,
+                                            self._chunk_size(num_unique))
+        else:
+            results = (align_sequence(aligner, vdj, self._alignment_cache)
+                       for vdj in vdjs)
+
+        for vdj, alignment, reason, error in funcs.periodic_commit(
+                output, results):
+            if alignment is not None:
                 # The alignment was successful.  If the aligned sequence
                 # already exists, append the seq_ids.  Otherwise add it as a
                 # new unique sequence.
-                alignment = aligner.get_alignment(vdj)
                 seq_key = alignment.sequence.sequence
                 if seq_key in alignments:
                     alignments[seq_key].sequence.ids.extend(
                         alignment.sequence.ids)
                 else:
                     alignments[seq_key] = alignment
-            except AlignmentException as e:
-                add_as_noresult(self._session, vdj, sample, str(e))
-            except Exception:
+            elif reason is not None:
+                self._add_noresult(output, vdj, sample, reason)
+            else:
                 self.error(
                     '\tUnexpected error processing sequence {}\n\t{}'.format(
-                        vdj.ids[0], traceback.format_exc()))
+                        vdj.ids[0], error))
+        self._log_throughput('Aligned', num_unique, start)
+
         if len(alignments) > 0:
-            avg_len = (
-                sum([v.v_length for v in alignments.values()]) /
-                float(len(alignments)))
-            avg_mut = (
-                sum([v.v_mutation_fraction for v in alignments.values()]) /
-                float(len(alignments))
-            )
-            sample.v_ties_mutations = avg_mut
-            sample.v_ties_len = avg_len
+            avg_len, avg_mut = _average_ties(alignments.values())
+            self._set_ties(sample, avg_len, avg_mut)
 
             self.info('\tRe-aligning {} sequences to V-ties, Mutations={}, '
-                      'Length={}'.format(len(alignments),
-                                         round(avg_mut, 2),
-                                         round(avg_len, 2)))
-            add_uniques(self._session, sample, alignments.values(),
-                        self._props, aligner, avg_len, avg_mut)
+                      'Length={}{}'.format(len(alignments),
+                                           round(avg_mut, 2),
+                                           round(avg_len, 2),
+                                           self._proc_message()))
+            start = time.time()
+            writer = self._get_sequence_writer(output, sample)
+            if self._nproc > 1:
+                add_uniques(output, sample,
+                            self._realign(sample, output, alignments.values(),
+                                          avg_len, avg_mut),
+                            self._props, aligner, writer=writer)
+            else:
+                add_uniques(output, sample, alignments.values(),
+                            self._props, aligner, avg_len, avg_mut,
+                            writer=writer)
+            self._log_throughput('Re-aligned', len(alignments), start)
+
+    def _estimate_ties(self, aligner, vdjs):
+        # As in the two-pass mode, sequences which align identically are
+        # averaged once using the first of them
+        alignments = {}
+        for vdj in vdjs:
+            _, alignment, _, _ = align_sequence(aligner, vdj,
+                                                self._alignment_cache)
+            if alignment is not None:
+                alignments.setdefault(alignment.sequence.sequence, alignment)
+        if len(alignments) == 0:
+            return None
+        avg_len, avg_mut = _average_ties(alignments.values())
+        self.info('\tEstimated V-tie parameters from {} of {} sampled '
+                  'sequences, Mutations={}, Length={}'.format(
+                      len(alignments), len(vdjs), round(avg_mut, 2),
+                      round(avg_len, 2)))
+        return avg_len, avg_mut
+
+    def _identify_streaming(self, sample, output, aligner, vdjs, num_unique,
+                            avg_len, avg_mut):
+        self._set_ties(sample, avg_len, avg_mut)
+
+        self.info('\tAligning and re-aligning {} unique sequences to '
+                  'V-ties{}'.format(num_unique, self._proc_message()))
+        start = time.time()
+        if self._nproc > 1:
+            results = self._get_pool().imap(
+                _pool_stream,
+                ((vdj, avg_len, avg_mut) for vdj in vdjs),
+                self._chunk_size(num_unique))
+        else:
+            results = (
+                stream_sequence(aligner, self._props, vdj, avg_len, avg_mut,
+                                self._alignment_cache)
+                for vdj in vdjs
+            )
 
+        writer = self._get_sequence_writer(output, sample)
+        # The parameters the two-pass mode would have used are accumulated to
+        # report the error of the estimate.  As there, sequences which align
+        # identically are counted once, so only a digest of each is kept.
+        seen = set()
+        aligned = total_len = total_mut = 0
+        for vdj, alignment, reason, error, initial in funcs.periodic_commit(
+                output, results):
+            if initial is not None and initial[0] not in seen:
+                seen.add(initial[0])
+                aligned += 1
+                total_len += initial[1]
+                total_mut += initial[2]
+            if alignment is not None:
+                writer.add(alignment)
+            elif reason is not None:
+                self._add_noresult(output, vdj, sample, reason)
+            else:
+                self.error(
+                    '\tUnexpected error processing sequence {}\n\t{}'.format(
+                        vdj.ids[0], error))
+        writer.flush()
+        self._log_throughput('Aligned and re-aligned', num_unique, start)
+
+        if aligned > 0:
+            exact_len = total_len / float(aligned)
+            exact_mut = total_mut / float(aligned)
+            self.info('\tV-tie estimate error over {} distinct aligned '
+                      'sequences: '
+                      'Mutations={} (estimated {}, error {}), Length={} '
+                      '(estimated {}, error {})'.format(
+                          aligned, round(exact_mut, 4), round(avg_mut, 4),
+                          round(avg_mut - exact_mut, 4), round(exact_len, 2),
+                          round(avg_len, 2), round(avg_len - exact_len, 2)))
+
+    def _set_ties(self, sample, avg_len, avg_mut):
+        sample.v_ties_mutations = avg_mut
+        sample.v_ties_len = avg_len
+        # The update to the sample is committed before sequences are written
+        # since, with a writer process, the writer's inserts referencing the
+        # sample would otherwise wait on this session's lock on it while this
+        # session waits for the writer
+        self._session.commit()
+
+    def _realign(self, sample, output, alignments, avg_len, avg_mut):
+        realigned = []
+        results = self._get_pool().imap(
+            _pool_realign,
+            ((alignment, avg_len, avg_mut) for alignment in alignments),
+            self._chunk_size(len(alignments)))
+        for vdj, alignment, reason, error in funcs.periodic_commit(
+                output, results):
+            if alignment is not None:
+                realigned.append(alignment)
+            elif reason is not None:
+                self._add_noresult(output, vdj, sample, reason)
+            else:
+                self.error(
+                    '\tUnexpected error processing sequence {}\n\t{}'.format(
+                        vdj.ids[0], error))
+        return realigned
+
+    def _add_noresult(self, output, vdj, sample, reason):
+        if reason.startswith(AnchorAligner.GERMLINE_KMERS_REASON):
+            self._rejected['unique'] += 1
+            self._rejected['reads'] += len(vdj.ids)
+        add_as_noresult(output, vdj, sample, reason)
+
+    def _set_progress(self, sample, complete):
+        self._session.merge(IdentificationProgress(sample_id=sample.id,
+                                                   complete=complete))
         self._session.commit()
-        self.info('Completed sample {}'.format(sample.name))
+
+    def _get_writer(self):
+        if self._writer is None:
+            self._writer = DatabaseWriter(self._db_config)
+        return self._writer
+
+    def _get_sequence_writer(self, output, sample):
+        if self._db_config:
+            return output.get_sequence_writer(sample)
+        return SequenceWriter(output, sample)
+
+    def _log_throughput(self, action, count, start):
+        elapsed = time.time() - start
+        self.info('\t{} {} sequences in {}s ({} per second)'.format(
+            action, count, round(elapsed, 1),
+            int(count / elapsed) if elapsed > 0 else count))
+
+    def _log_writer_stats(self, stats):
+        # If the queue was often full the writer is the bottleneck; if the
+        # writer was mostly idle the alignment is
+        self.info('\tWrote {} rows in {} batches; writer busy {}s, idle {}s; '
+                  'max queue depth {}/{}, blocked {}s on a full '
+                  'queue'.format(stats['rows'], stats['batches'],
+                                 round(stats['busy'], 1),
+                                 round(stats['idle'], 1), stats['max_depth'],
+                                 stats['max_batches'],
+                                 round(stats['blocked'], 1)))
+
+    def _log_cache_stats(self, stats):
+        lookups = stats['hits'] + stats['misses']
+        self.info('\tAlignment cache: {} hits of {} lookups ({}%), {} '
+                  'entries evicted'.format(
+                      stats['hits'], lookups,
+                      round(100.0 * stats['hits'] / lookups, 1)
+                      if lookups > 0 else 0, stats['evicted']))
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = mp.Pool(self._nproc, initializer=_init_pool,
+                                 initargs=(self._v_germlines,
+                                           self._j_germlines, self._props,
+                                           self._alignment_cache))
+        return self._pool
+
+    def _chunk_size(self, total):
+        return max(1, min(self.MAX_CHUNK_SIZE,
+                          total // (self._nproc * self.CHUNKS_PER_PROC)))
+
+    def _proc_message(self):
+        if self._nproc > 1:
+            return ' across {} processes'.format(self._nproc)
+        return ''
 
     def cleanup(self):
         self.info('Identification worker terminating')
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+        if self._writer is not None:
+            self._writer.close()
+        if self._alignment_cache is not None:
+            self._alignment_cache.close()
         self._session.close()
 
     def _setup_sample(self, meta):
@@ -198,17 +578,43 @@ class IdentificationWorker(concurrent.Worker):
         self._session.commit()
         self._sync_lock.release()
 
+        # A sample left incomplete by an earlier run is rolled back before
+        # being identified again
+        progress = self._session.query(IdentificationProgress).get(sample.id)
+        if progress is not None and not progress.complete:
+            self.info('\tRolling back sample interrupted at {}'.format(
+                progress.updated))
+            deleted = rollback_sample(self._session, sample.id)
+            self.info('\tDeleted {}'.format(', '.join(
+                '{} {}'.format(count, table)
+                for table, count in deleted.iteritems())))
+
         return study, sample
 
 
+def get_alignment_cache(args, v_germlines, j_germlines, props):
+    """Creates an :py:class:`AlignmentCache` from the ``alignment_cache`` and
+    ``alignment_cache_size`` (in MB) arguments.
+
+    :returns: The cache or ``None`` if ``alignment_cache`` is not specified
+
+    """
+    if not args.alignment_cache:
+        return None
+    max_size = (args.alignment_cache_size * 1024 * 1024
+                if args.alignment_cache_size else None)
+    return AlignmentCache(args.alignment_cache, v_germlines, j_germlines,
+                          props, max_size)
+
+
 def run_identify(session, args):
     mod_log.make_mod('identification', session=session, commit=True,
                      info=vars(args))
     session.close()
     # Load the germlines from files
-    v_germlines = VGermlines(args.v_germlines)
-    j_germlines = JGermlines(args.j_germlines, args.upstream_of_cdr3,
-                             args.anchor_len, args.min_anchor_len)
+    v_germlines, j_germlines = load_germlines(
+        args.v_germlines, args.j_germlines, args.upstream_of_cdr3,
+        args.anchor_len, args.min_anchor_len, args.germline_cache)
     tasks = concurrent.TaskQueue()
 
     # If metadata is not specified, assume it is "metadata." in the
@@ -224,7 +630,7 @@ def run_identify(session, args):
     with open(meta_fn, 'rU') as fh:
         try:
             metadata = parse_metadata(session, fh, args.warn_existing,
-                                      args.sample_dir)
+                                      args.sample_dir, args.resume)
         except MetadataException as ex:
             logger.error(ex.message)
             return
@@ -239,9 +645,31 @@ def run_identify(session, args):
 
     props = IdentificationProps(**args.__dict__)
     lock = mp.Lock()
-    for i in range(0, min(args.nproc, tasks.num_tasks())):
+    dedup_memory = (args.dedup_memory * 1024 * 1024 if args.dedup_memory
+                    else None)
+    # Workers only start a writer process if given its database configuration
+    writer_config = args.db_config if args.writer_process else None
+    if args.shard_samples:
+        # Identify samples one at a time, splitting each across all processes
+        logger.info('Identifying samples with {} processes each'.format(
+            args.nproc))
         worker_session = config.init_db(args.db_config)
-        tasks.add_worker(IdentificationWorker(worker_session, v_germlines,
-                                              j_germlines, props, lock))
+        tasks.add_worker(IdentificationWorker(
+            worker_session, v_germlines, j_germlines, props, lock,
+            nproc=args.nproc, dedup_memory=dedup_memory, temp_dir=args.temp,
+            db_config=writer_config,
+            stream_sample_size=args.stream_sample_size,
+            alignment_cache=get_alignment_cache(args, v_germlines,
+                                                j_germlines, props)))
+    else:
+        for i in range(0, min(args.nproc, tasks.num_tasks())):
+            worker_session = config.init_db(args.db_config)
+            tasks.add_worker(IdentificationWorker(
+                worker_session, v_germlines, j_germlines, props, lock,
+                dedup_memory=dedup_memory, temp_dir=args.temp,
+                db_config=writer_config,
+                stream_sample_size=args.stream_sample_size,
+                alignment_cache=get_alignment_cache(args, v_germlines,
+                                                    j_germlines, props)))
 
     tasks.start()
@@ -11,8 +11,8 @@ import dnautils
 
 from immunedb.identification import add_as_sequence, AlignmentException
 from immunedb.identification.vdj_sequence import VDJAlignment, VDJSequence
-from immunedb.identification.genes import (CDR3_OFFSET, GeneName, JGermlines,
-                                           VGermlines)
+from immunedb.identification.genes import (CDR3_OFFSET, GeneName,
+                                           load_germlines)
 from immunedb.identification.identify import IdentificationProps
 from immunedb.common.models import (DuplicateSequence, NoResult, Sample,
                                     Sequence, serialize_gaps)
@@ -430,8 +430,9 @@ def remove_duplicates(session, sample):
 
 
 def run_fix_sequences(session, args):
-    v_germlines = VGermlines(args.v_germlines)
-    j_germlines = JGermlines(args.j_germlines, args.upstream_of_cdr3)
+    v_germlines, j_germlines = load_germlines(
+        args.v_germlines, args.j_germlines, args.upstream_of_cdr3,
+        cache_dir=args.germline_cache)
 
     indexes = set()
     props = IdentificationProps(**args.__dict__)
@@ -3,7 +3,7 @@ import os
 
 from sqlalchemy.sql import exists
 
-from immunedb.common.models import Sample, Sequence
+from immunedb.common.models import IdentificationProgress, Sample, Sequence
 from immunedb.util.log import logger
 
 REQUIRED_FIELDS = ('file_name', 'study_name', 'sample_name', 'date', 'subject')
@@ -25,7 +25,7 @@ def check_populated(row):
                 ','.join(missing), row['sample_name']))
 
 
-def parse_metadata(session, fh, warn_existing, path):
+def parse_metadata(session, fh, warn_existing, path, resume=False):
     reader = csv.DictReader(fh, delimiter='\t')
     provided_fields = set(reader.fieldnames)
     missing_fields = set(REQUIRED_FIELDS) - provided_fields
@@ -51,18 +51,33 @@ def parse_metadata(session, fh, warn_existing, path):
             logger.error('Duplicate sample name {} in metadata.'.format(
                 row['sample_name']))
 
-        # Check if a sample with the same name is in the database
-        sample_in_db = session.query(Sample).filter(
-            Sample.name == row['sample_name'],
-            exists().where(
-                Sequence.sample_id == Sample.id
-            )).first()
-        if sample_in_db:
+        # Check if a sample with the same name is in the database, either
+        # partially identified by an interrupted run or complete
+        progress = session.query(IdentificationProgress).join(Sample).filter(
+            Sample.name == row['sample_name']).first()
+        if progress is not None and not progress.complete:
+            if resume:
+                logger.warning(
+                    'Sample {} was partially identified.  It will be rolled '
+                    'back and identified again.'.format(row['sample_name']))
+            elif warn_existing:
+                logger.warning('Sample {} was partially identified. '
+                               'Skipping.'.format(row['sample_name']))
+                continue
+            else:
+                raise MetadataException(
+                    'Sample {} was partially identified.  Use --resume to '
+                    'identify it again.'.format(row['sample_name']))
+        elif progress is not None or session.query(Sample).filter(
+                Sample.name == row['sample_name'],
+                exists().where(
+                    Sequence.sample_id == Sample.id
+                )).first():
             message = 'Sample {} already exists. {}'.format(
                 row['sample_name'],
-                'Skipping.' if warn_existing else 'Cannot continue.'
+                'Skipping.' if warn_existing or resume else 'Cannot continue.'
             )
-            if warn_existing:
+            if warn_existing or resume:
                 logger.warning(message)
                 continue
             else:
@@ -0,0 +1,153 @@
+import random
+
+from immunedb.common.models import CDR3_OFFSET
+from immunedb.identification.vdj_sequence import VDJSequence
+
+NUCLEOTIDES = 'ACGT'
+
+
+class SyntheticRepertoire(object):
+    """Generates synthetic reads by recombining V and J germlines.  Each read
+    is an ungapped V germline, possibly trimmed at both ends, joined to a J
+    germline, possibly trimmed at its 5' end, by random non-templated
+    nucleotides.  Reads are then mutated and may have indels, Ns, and be
+    reverse complemented.  As in selected repertoires, the conserved residues
+    at the end of the V and the anchor of the J are not mutated.  Some
+    reads are exact copies of earlier ones so that identical reads are
+    collapsed as in real samples.
+
+    Reads are generated deterministically from ``seed``.
+
+    :param VGermlines v_germlines: The V germlines to draw from
+    :param JGermlines j_germlines: The J germlines to draw from
+    :param float mutation: The average fraction of positions mutated in each
+        read
+    :param float indel_rate: The fraction of reads with an insertion or
+        deletion in the V
+    :param float n_rate: The fraction of positions replaced with an N
+    :param float rc_rate: The fraction of reads which are reverse complemented
+    :param float duplicate_rate: The fraction of reads which are copies of an
+        earlier read
+    :param int max_v_trim: The maximum number of nucleotides removed from the
+        5' end of the V
+    :param int max_junction: The maximum number of non-templated nucleotides
+        between the V and J
+    :param int seed: The random seed
+
+    """
+    # The most nucleotides trimmed from the germlines at the junction
+    MAX_JUNCTION_TRIM = 6
+    # The number of recent reads from which duplicates are drawn
+    DUPLICATE_POOL = 1000
+    # The length of indels
+    MAX_INDEL_LEN = 3
+    # Indels are not placed this close to the 5' end of the V
+    INDEL_MARGIN = 30
+    # The number of nucleotides up to and including the cysteine codon at the
+    # start of the CDR3 which are not mutated
+    CONSERVED_LEN = 21
+
+    def __init__(self, v_germlines, j_germlines, mutation=.05,
+                 indel_rate=.01, n_rate=.001, rc_rate=0, duplicate_rate=.3,
+                 max_v_trim=30, max_junction=12, seed=0):
+        self._v_germlines = sorted(
+            (str(name), seq.replace('-', ''),
+             CDR3_OFFSET - seq[:CDR3_OFFSET].count('-'))
+            for name, seq in v_germlines.iteritems())
+        self._j_germlines = sorted(
+            (str(name), seq) for name, seq in j_germlines.iteritems())
+        self._j_anchor_len = j_germlines.anchor_len
+        self._mutation = mutation
+        self._indel_rate = indel_rate
+        self._n_rate = n_rate
+        self._rc_rate = rc_rate
+        self._duplicate_rate = duplicate_rate
+        self._max_v_trim = max_v_trim
+        self._max_junction = max_junction
+        self._seed = seed
+
+    def generate(self, count):
+        """Generates reads.
+
+        :param int count: The number of reads to generate
+
+        :returns: Tuples of ``(seq_id, sequence, quality)``.  Each ID includes
+            the V and J germlines the read was drawn from.
+
+        """
+        rng = random.Random(self._seed)
+        recent = []
+        for i in xrange(count):
+            if len(recent) > 0 and rng.random() < self._duplicate_rate:
+                genes, sequence = rng.choice(recent)
+            else:
+                v_name, v_seq, v_cdr3 = rng.choice(self._v_germlines)
+                j_name, j_seq = rng.choice(self._j_germlines)
+                genes = '{}|{}'.format(v_name, j_name)
+                sequence = self._recombine(rng, v_seq, v_cdr3, j_seq)
+                if len(recent) < self.DUPLICATE_POOL:
+                    recent.append((genes, sequence))
+                else:
+                    recent[rng.randrange(self.DUPLICATE_POOL)] = (
+                        genes, sequence)
+            quality = ''.join('#' if c == 'N' else 'I' for c in sequence)
+            yield 'synthetic{}|{}'.format(i, genes), sequence, quality
+
+    def _recombine(self, rng, v_seq, v_cdr3, j_seq):
+        v_start = rng.randint(0, self._max_v_trim)
+        v_end = len(v_seq) - rng.randint(0, self.MAX_JUNCTION_TRIM)
+        v_seq = list(v_seq[v_start:v_end])
+        conserved = v_cdr3 + 3 - v_start - self.CONSERVED_LEN
+        junction = [rng.choice(NUCLEOTIDES)
+                    for _ in range(rng.randint(0, self._max_junction))]
+        j_seq = list(j_seq[rng.randint(0, self.MAX_JUNCTION_TRIM):])
+
+        if rng.random() < self._indel_rate and (
+                conserved > self.INDEL_MARGIN):
+            pos = rng.randint(self.INDEL_MARGIN, conserved)
+            size = rng.randint(1, self.MAX_INDEL_LEN)
+            if rng.random() < .5:
+                v_seq[pos:pos] = [rng.choice(NUCLEOTIDES)
+                                  for _ in range(size)]
+                conserved += size
+            else:
+                del v_seq[pos:pos + size]
+                conserved -= size
+
+        sequence = v_seq + junction + j_seq
+        # The mutation fraction of each read is uniform around the average,
+        # and positions are drawn from those outside the conserved residues
+        # and J anchor
+        fraction = rng.uniform(0, 2 * self._mutation)
+        mutable = len(sequence) - self.CONSERVED_LEN - self._j_anchor_len
+        for pos in rng.sample(xrange(mutable),
+                              int(round(fraction * mutable))):
+            if pos >= conserved:
+                pos += self.CONSERVED_LEN
+            sequence[pos] = rng.choice(NUCLEOTIDES.replace(sequence[pos], ''))
+        if self._n_rate > 0:
+            for pos in xrange(len(sequence)):
+                if rng.random() < self._n_rate:
+                    sequence[pos] = 'N'
+
+        sequence = ''.join(sequence)
+        if rng.random() < self._rc_rate:
+            sequence = VDJSequence('', sequence).reverse_complement().sequence
+        return sequence
+
+
+def write_fastq(fh, reads):
+    """Writes reads in FASTQ format.
+
+    :param file fh: The file to write to
+    :param iter reads: Tuples of ``(seq_id, sequence, quality)``
+
+    :returns: The number of reads written
+    :rtype: int
+
+    """
+    count = 0
+    for seq_id, sequence, quality in reads:
+        fh.write('@{}\n{}\n+\n{}\n'.format(seq_id, sequence, quality))
+        count += 1
+    return count
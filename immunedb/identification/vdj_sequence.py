@@ -1,13 +1,60 @@
+import functools
 import re
-
-from Bio.Seq import Seq
+import string
 
 import dnautils
 from immunedb.common.models import CDR3_OFFSET
 import immunedb.util.lookups as lookups
 
 
+# Shared by alignments without indels so each need not allocate its own sets
+NO_INDELS = frozenset()
+
+_COMPLEMENTS = string.maketrans('ACGTN-', 'TGCAN-')
+
+
+def _insert_gaps(seq, gaps, gap_char, length, fill_char):
+    # The k-th gap is inserted after the first gaps[k] - k characters of the
+    # original sequence, or at the end if it is shorter.  The result is then
+    # trimmed or filled to length.
+    pieces = []
+    last = 0
+    for k, pos in enumerate(gaps):
+        take = min(pos - k, len(seq))
+        pieces.append(seq[last:take])
+        pieces.append(gap_char)
+        last = take
+    pieces.append(seq[last:])
+    result = ''.join(pieces)
+    if len(result) > length:
+        return result[:length]
+    return result + fill_char * (length - len(result))
+
+
+def _metric(func):
+    # A property of VDJAlignment whose value is cached until the alignment
+    # changes
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self):
+        metrics = self._get_metrics()
+        try:
+            return metrics[name]
+        except KeyError:
+            value = metrics[name] = func(self)
+            return value
+    return property(wrapper)
+
+
 class VDJSequence(object):
+    # Slots avoid a dictionary per instance since one is held for every unique
+    # sequence in a sample.  Unmodified sequences and qualities are shared
+    # with their originals rather than copied.
+    __slots__ = ('ids', 'orig_sequence', 'orig_quality', '_sequence',
+                 '_quality', '_removed_prefix_sequence',
+                 '_removed_prefix_quality')
+
     def __init__(self, ids, sequence, quality=None):
         if quality and len(sequence) != len(quality):
             raise ValueError('Sequence and quality must be the same length')
@@ -16,8 +63,8 @@ class VDJSequence(object):
                 sequence))
 
         self.ids = [ids] if type(ids) == str else ids
-        self.orig_sequence = sequence[:]
-        self.orig_quality = quality[:] if quality else None
+        self.orig_sequence = sequence
+        self.orig_quality = quality if quality else None
         self._sequence = sequence
         self._quality = quality
         self._removed_prefix_sequence = ''
@@ -40,13 +87,14 @@ class VDJSequence(object):
         return self._removed_prefix_quality
 
     def reverse_complement(self, in_place=False):
+        rc = self._sequence.translate(_COMPLEMENTS)[::-1]
         if not in_place:
             return VDJSequence(
                 self.ids,
-                str(Seq(self._sequence).reverse_complement()),
+                rc,
                 self._quality[::-1] if self._quality else None
             )
-        self._sequence = str(Seq(self._sequence).reverse_complement())
+        self._sequence = rc
         self._quality = self._quality[::-1]
 
     def pad(self, count):
@@ -84,6 +132,34 @@ class VDJSequence(object):
         if self._quality:
             self._quality = self._quality[:pos] + ' ' + self._quality[pos:]
 
+    def align(self, offset, gaps, length):
+        """Pads or removes a prefix, inserts gaps, and pads or trims the end
+        of the sequence, building each of the sequence and quality once.
+        This is equivalent to calling :py:meth:`pad` with ``offset`` if it is
+        non-negative or :py:meth:`remove_prefix` with ``-offset`` otherwise,
+        then :py:meth:`add_gap` for each position in ``gaps``, and finally
+        :py:meth:`trim_right` or :py:meth:`pad_right` to make the sequence
+        ``length`` long.
+
+        :param int offset: The number of positions to pad, or if negative
+            remove from, the beginning of the sequence
+        :param list gaps: The increasing positions of gaps in the resulting
+            sequence
+        :param int length: The length of the resulting sequence
+
+        """
+        if offset >= 0:
+            self._sequence = ('N' * offset) + self._sequence
+            if self._quality:
+                self._quality = (' ' * offset) + self._quality
+        else:
+            self.remove_prefix(-offset)
+
+        self._sequence = _insert_gaps(self._sequence, gaps, '-', length, 'N')
+        if self._quality:
+            self._quality = _insert_gaps(self._quality, gaps, ' ', length,
+                                         ' ')
+
     def rfind(self, seq):
         return self._sequence.rfind(seq)
 
@@ -96,11 +172,28 @@ class VDJSequence(object):
     def __len__(self):
         return len(self._sequence)
 
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
 
 class VDJAlignment(object):
     INDEL_WINDOW = 30
     INDEL_MISMATCH_THRESHOLD = .6
 
+    _FIELDS = ('sequence', 'germline', 'j_gene', 'v_gene',
+               'locally_aligned', 'seq_offset', 'v_length', 'j_length',
+               'v_mutation_fraction', 'cdr3_start', 'cdr3_num_nts',
+               'germline_cdr3', 'post_cdr3_length', 'insertions',
+               'deletions', 'j_anchor_pos')
+    # Computed metrics are cached in _metrics for the sequence string in
+    # _metrics_sequence.  Setting any field clears the cache, as does
+    # modifying the sequence since that always replaces its string.
+    __slots__ = _FIELDS + ('_metrics', '_metrics_sequence')
+
     def __init__(self, sequence):
         self.sequence = sequence
         self.germline = None
@@ -116,10 +209,30 @@ class VDJAlignment(object):
         self.cdr3_num_nts = 0
         self.germline_cdr3 = None
         self.post_cdr3_length = 0
-        self.insertions = set([])
-        self.deletions = set([])
-
-    @property
+        self.insertions = NO_INDELS
+        self.deletions = NO_INDELS
+        self.j_anchor_pos = None
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, '_metrics', None)
+
+    def _get_metrics(self):
+        sequence = self.sequence.sequence
+        if self._metrics is None or self._metrics_sequence is not sequence:
+            object.__setattr__(self, '_metrics', {})
+            object.__setattr__(self, '_metrics_sequence', sequence)
+        return self._metrics
+
+    def invalidate_metrics(self):
+        """Clears the cached metrics.  This is only necessary if a mutable
+        value used to compute them is modified in place; assigning to an
+        attribute or modifying the sequence clears them automatically.
+
+        """
+        object.__setattr__(self, '_metrics', None)
+
+    @_metric
     def filled_germline(self):
         return ''.join((
             self.germline[:self.cdr3_start],
@@ -131,7 +244,7 @@ class VDJAlignment(object):
     def seq_start(self):
         return max(0, self.seq_offset)
 
-    @property
+    @_metric
     def num_gaps(self):
         return self.sequence[self.seq_start:self.cdr3_start].count('-')
 
@@ -148,7 +261,7 @@ class VDJAlignment(object):
     def in_frame(self):
         return len(self.cdr3) % 3 == 0 and self.cdr3_start % 3 == 0
 
-    @property
+    @_metric
     def stop(self):
         return lookups.has_stop(self.sequence)
 
@@ -156,7 +269,7 @@ class VDJAlignment(object):
     def functional(self):
         return self.in_frame and not self.stop
 
-    @property
+    @_metric
     def v_match(self):
         start = self.seq_start
         end = start + self.v_length + self.num_gaps
@@ -166,7 +279,7 @@ class VDJAlignment(object):
             self.sequence[start:end]
         )
 
-    @property
+    @_metric
     def j_match(self):
         return self.j_length - dnautils.hamming(
             self.filled_germline[-self.j_length:],
@@ -177,7 +290,7 @@ class VDJAlignment(object):
     def pre_cdr3_length(self):
         return self.cdr3_start - self.seq_start - self.num_gaps
 
-    @property
+    @_metric
     def pre_cdr3_match(self):
         start = self.seq_start + self.num_gaps
         end = self.cdr3_start
@@ -187,28 +300,31 @@ class VDJAlignment(object):
             self.sequence[start:end]
         )
 
-    @property
+    @_metric
     def post_cdr3_match(self):
         return self.post_cdr3_length - dnautils.hamming(
             self.germline[-self.post_cdr3_length:],
             self.sequence[-self.post_cdr3_length:]
         )
 
-    @property
+    @_metric
     def has_possible_indel(self):
         # Start comparison on first full AA to the INDEL_WINDOW or CDR3,
         # whichever comes first
         start = re.search('[ATCG]', self.sequence.sequence).start()
-        germ = self.germline[start:self.cdr3_start]
-        seq = self.sequence[start:self.cdr3_start]
+        return dnautils.window_hamming_exceeds(
+            self.germline[start:self.cdr3_start],
+            self.sequence[start:self.cdr3_start],
+            self.INDEL_WINDOW,
+            self.INDEL_MISMATCH_THRESHOLD * self.INDEL_WINDOW
+        )
 
-        for i in range(0, len(germ) - self.INDEL_WINDOW + 1):
-            dist = dnautils.hamming(germ[i:i+self.INDEL_WINDOW],
-                                    seq[i:i+self.INDEL_WINDOW])
-            if dist >= self.INDEL_MISMATCH_THRESHOLD * self.INDEL_WINDOW:
-                return True
+    def __getstate__(self):
+        return tuple(getattr(self, field) for field in self._FIELDS)
 
-        return False
+    def __setstate__(self, state):
+        for field, value in zip(self._FIELDS, state):
+            setattr(self, field, value)
 
     def trim_to(self, count):
         old_padding = self.seq_start
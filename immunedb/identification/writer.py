@@ -0,0 +1,200 @@
+import multiprocessing as mp
+import Queue
+import time
+import traceback
+
+import immunedb.common.config as config
+from immunedb.identification import SequenceWriter, write_sequences
+
+
+class WriterException(Exception):
+    pass
+
+
+class DatabaseWriter(object):
+    """Writes the results of identification from a separate process so that
+    database I/O overlaps with alignment.
+
+    Objects are buffered and sent to the writer process in batches over a
+    bounded queue.  The writer process inserts and commits each batch in the
+    order they were sent.  Instances provide the ``bulk_save_objects`` and
+    ``commit`` methods of a session so they may be passed in place of one to
+    functions such as :py:func:`add_as_noresult`.
+
+    :param str db_config: Path to the database configuration
+    :param int batch_size: The number of objects to send in each batch
+    :param int max_batches: The maximum number of batches waiting to be
+        written before senders block
+
+    """
+    # Seconds between checks that the writer process is alive while waiting
+    # on it
+    POLL_INTERVAL = 1
+
+    def __init__(self, db_config, batch_size=1000, max_batches=16):
+        self._batch_size = batch_size
+        self._max_batches = max_batches
+        self._queue = mp.Queue(max_batches)
+        self._results = mp.Queue()
+        self._objects = []
+        self._reset_stats()
+
+        self._process = mp.Process(target=self._run, args=(db_config,))
+        self._process.daemon = True
+        self._process.start()
+
+    def bulk_save_objects(self, objects):
+        self._objects.extend(objects)
+        if len(self._objects) >= self._batch_size:
+            self._send_objects()
+
+    def commit(self):
+        # The writer process commits after each batch
+        pass
+
+    def get_sequence_writer(self, sample):
+        """Gets a :py:class:`SequenceWriter` for ``sample`` which sends
+        sequences to the writer process.
+
+        """
+        return _QueuedSequenceWriter(self, sample)
+
+    def write_sequences(self, sample_id, sequences):
+        self._send_objects()
+        self._put(('sequences', sample_id, sequences))
+
+    def sync(self):
+        """Waits for all objects sent so far to be written and committed.
+
+        :returns: A dictionary of statistics since the last call
+        :rtype: dict
+
+        """
+        self._send_objects()
+        self._put(('sync',))
+        error, writer_stats = self._get_result()
+        if error is not None:
+            raise WriterException(
+                'Error in database writer:\n{}'.format(error))
+        stats = self._stats
+        stats.update(writer_stats)
+        stats['max_batches'] = self._max_batches
+        self._reset_stats()
+        return stats
+
+    def reset(self):
+        """Discards buffered objects and waits for those already sent to be
+        written, so that an error writing them is not reported by a later
+        :py:meth:`sync`.
+
+        :returns: The error writing the objects already sent, if any
+        :rtype: str
+
+        """
+        self._objects = []
+        try:
+            self._put(('sync',))
+            error, _ = self._get_result()
+        except WriterException as e:
+            error = str(e)
+        self._reset_stats()
+        return error
+
+    def close(self):
+        if self._process.is_alive():
+            self._put(None)
+        self._process.join()
+
+    def _reset_stats(self):
+        self._stats = {'batches': 0, 'max_depth': 0, 'blocked': 0.0}
+
+    def _send_objects(self):
+        if len(self._objects) > 0:
+            self._put(('objects', self._objects))
+            self._objects = []
+
+    def _put(self, item):
+        try:
+            self._stats['max_depth'] = max(self._stats['max_depth'],
+                                           self._queue.qsize())
+        except NotImplementedError:
+            # Queue sizes are not available on some platforms
+            pass
+        start = time.time()
+        while True:
+            try:
+                self._queue.put(item, timeout=self.POLL_INTERVAL)
+                break
+            except Queue.Full:
+                self._check_alive()
+        self._stats['blocked'] += time.time() - start
+        if item is not None and item[0] != 'sync':
+            self._stats['batches'] += 1
+
+    def _get_result(self):
+        while True:
+            try:
+                return self._results.get(timeout=self.POLL_INTERVAL)
+            except Queue.Empty:
+                if not self._process.is_alive():
+                    # The process may have exited right after responding
+                    try:
+                        return self._results.get(timeout=self.POLL_INTERVAL)
+                    except Queue.Empty:
+                        self._check_alive()
+
+    def _check_alive(self):
+        if not self._process.is_alive():
+            raise WriterException(
+                'Database writer process exited with code {}'.format(
+                    self._process.exitcode))
+
+    def _run(self, db_config):
+        # A failure to connect is reported by every sync rather than exiting
+        # so senders are not left waiting
+        try:
+            session = config.init_db(db_config)
+            setup_error = None
+        except Exception:
+            session = None
+            setup_error = traceback.format_exc()
+        error = setup_error
+        stats = {'rows': 0, 'busy': 0.0, 'idle': 0.0}
+        while True:
+            start = time.time()
+            item = self._queue.get()
+            stats['idle'] += time.time() - start
+            if item is None:
+                break
+
+            if item[0] == 'sync':
+                self._results.put((error, stats))
+                error = setup_error
+                stats = {'rows': 0, 'busy': 0.0, 'idle': 0.0}
+                continue
+            elif error is not None:
+                # Discard everything after an error until the next sync
+                continue
+
+            start = time.time()
+            try:
+                if item[0] == 'objects':
+                    session.bulk_save_objects(item[1])
+                    stats['rows'] += len(item[1])
+                else:
+                    _, sample_id, sequences = item
+                    write_sequences(session, sample_id, sequences)
+                    stats['rows'] += sum(1 + len(duplicates)
+                                         for _, duplicates in sequences)
+                session.commit()
+            except Exception:
+                error = traceback.format_exc()
+                session.rollback()
+            stats['busy'] += time.time() - start
+        if session is not None:
+            session.close()
+
+
+class _QueuedSequenceWriter(SequenceWriter):
+    def _write(self, sequences):
+        self._session.write_sequences(self._sample.id, sequences)
@@ -5,8 +5,9 @@ from immunedb.common.models import NoResult, Sample, Study, Subject
 from immunedb.identification import (add_as_noresult, add_uniques,
                                      AlignmentException)
 from immunedb.identification.anchor import AnchorAligner
-from immunedb.identification.genes import JGermlines, VGermlines
-from immunedb.identification.identify import IdentificationProps
+from immunedb.identification.genes import load_germlines
+from immunedb.identification.identify import (get_alignment_cache,
+                                              IdentificationProps)
 from immunedb.identification.vdj_sequence import VDJSequence
 import immunedb.util.funcs as funcs
 from immunedb.util.log import logger
@@ -48,7 +49,7 @@ def _collapse_seqs(session, sample, reader, columns):
 
 
 def read_file(session, handle, sample, v_germlines, j_germlines, columns,
-              remaps):
+              remaps, alignment_cache=None):
     seqs = _collapse_seqs(session, sample, csv.DictReader(handle,
                           delimiter='\t'), columns)
     props = IdentificationProps(**columns.__dict__)
@@ -95,8 +96,12 @@ def read_file(session, handle, sample, v_germlines, j_germlines, columns,
                     ','.join(sorted(orig_j_genes))
                 ))
 
-            alignment = aligner.get_alignment(vdj, limit_vs=v_genes,
-                                              limit_js=j_genes)
+            if alignment_cache is not None:
+                alignment = alignment_cache.get_alignment(
+                    aligner, vdj, limit_vs=v_genes, limit_js=j_genes)
+            else:
+                alignment = aligner.get_alignment(vdj, limit_vs=v_genes,
+                                                  limit_js=j_genes)
 
             if alignment.sequence.sequence in aligned_seqs:
                 aligned_seqs[alignment.sequence].ids += vdj.ids
@@ -122,13 +127,17 @@ def read_file(session, handle, sample, v_germlines, j_germlines, columns,
                         realign_mut=avg_mut, realign_len=avg_len)
         else:
             add_uniques(session, sample, aligned_seqs.values())
+    if alignment_cache is not None:
+        stats = alignment_cache.get_stats()
+        logger.info('Alignment cache: {} hits of {} lookups'.format(
+            stats['hits'], stats['hits'] + stats['misses']))
     session.commit()
 
 
 def run_import(session, args, remaps=None):
-    v_germlines = VGermlines(args.v_germlines)
-    j_germlines = JGermlines(args.j_germlines, args.upstream_of_cdr3,
-                             args.anchor_len, args.min_anchor_len)
+    v_germlines, j_germlines = load_germlines(
+        args.v_germlines, args.j_germlines, args.upstream_of_cdr3,
+        args.anchor_len, args.min_anchor_len, args.germline_cache)
 
     study, new = funcs.get_or_create(session, Study, name=args.study_name)
 
@@ -153,5 +162,10 @@ def run_import(session, args, remaps=None):
         logger.error('Sample "{}" already exists'.format(args.sample_name))
         return
 
+    alignment_cache = get_alignment_cache(
+        args, v_germlines, j_germlines, IdentificationProps(**args.__dict__))
     with open(args.input_file) as fh:
-        read_file(session, fh, sample, v_germlines, j_germlines, args, remaps)
+        read_file(session, fh, sample, v_germlines, j_germlines, args, remaps,
+                  alignment_cache)
+    if alignment_cache is not None:
+        alignment_cache.close()
@@ -1,5 +1,7 @@
 from collections import Counter
 
+import dnautils
+
 
 def consensus(strings):
     """Gets the unweighted consensus from a list of strings
@@ -59,6 +61,31 @@ def periodic_commit(session, query, interval=10):
     session.commit()
 
 
+def _equal_many(seq, others):
+    return [len(seq) == len(other) and dnautils.equal(seq, other)
+            for other in others]
+
+
+def get_equal_many(seqs):
+    """Prepares sequences to be compared with one another as with
+    :py:func:`dnautils.equal`.  Sequences are packed with
+    :py:func:`dnautils.pack` unless any has a character it cannot encode, such
+    as a lowercase or IUPAC base, in which case they are compared unpacked.
+
+    :param list seqs: The sequences to compare
+
+    :returns: A tuple ``(keys, equal_many)`` with one key per sequence where
+        ``equal_many(key, other_keys)`` lists whether the sequence with
+        ``key`` equals each of the sequences with ``other_keys``
+    :rtype: tuple
+
+    """
+    try:
+        return [dnautils.pack(seq) for seq in seqs], dnautils.packed_equal_many
+    except dnautils.error:
+        return list(seqs), _equal_many
+
+
 def get_or_create(session, model, **kwargs):
     """Gets or creates a record based on some kwargs search parameters"""
     instance = session.query(model).filter_by(**kwargs).first()
@@ -22,3 +22,60 @@ def hypergeom(length, mutation, K):
         [pmf(k) * np.power(.33, k)
             for k in xrange(int(np.ceil(K / 2)), K)]
     )
+
+
+_choose_rows = []
+
+
+def _get_choose_rows(max_n):
+    # Row n holds choose(n, k) for 0 <= k < n, which depends only on n and
+    # so is shared between all tables
+    while len(_choose_rows) <= max_n:
+        n = len(_choose_rows)
+        row = []
+        power, factorial = 1, 1
+        for k in range(n):
+            row.append(power / factorial)
+            power *= n
+            factorial *= k + 1
+        _choose_rows.append(np.array(row, dtype=np.float64))
+    return _choose_rows
+
+
+def hypergeom_table(length, mutation):
+    """Computes :py:func:`hypergeom` for every ``K`` from 0 to ``length``.
+    The terms for all ``K`` are computed together and each sum is taken over
+    the same terms in the same order as :py:func:`hypergeom`, so the results
+    are identical.
+
+    :param int length: The length of the compared sequences
+    :param float mutation: The mutation fraction
+
+    :returns: An array where element ``K`` is ``hypergeom(length, mutation,
+        K)``
+    :rtype: numpy.ndarray
+
+    """
+    M = length
+    N = np.ceil(length * mutation)
+    # Terms where k > N are zero so only the first max_k + 1 are computed
+    max_k = int(min(N, max(M - 1, 0)))
+    ks = np.arange(max_k + 1)
+
+    denominator = choose(M, N)
+    factorials = np.array([math.factorial(N - k) for k in ks],
+                          dtype=np.float64)
+    powers = np.power(.33, ks)
+    rows = _get_choose_rows(M)
+
+    table = np.zeros(M + 1)
+    terms = np.zeros(M + 1)
+    for K in xrange(1, M):
+        # Only k < K contribute to the sum
+        width = min(K, max_k + 1)
+        second = np.power(np.float64(M - K), N - ks[:width]) / \
+            factorials[:width]
+        terms[:width] = rows[K][:width] * second / denominator * \
+            powers[:width]
+        table[K] = np.sum(terms[K // 2:K])
+    return table
@@ -0,0 +1,197 @@
+import bz2
+import gzip
+import os
+import threading
+import Queue
+
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2')
+FASTA_EXTENSIONS = ('.fasta', '.fa')
+FASTQ_EXTENSIONS = ('.fastq', '.fq')
+
+
+def strip_compression(path):
+    """Removes a compression extension, if any, from ``path``"""
+    base, ext = os.path.splitext(path)
+    if ext in COMPRESSED_EXTENSIONS:
+        return base
+    return path
+
+
+def is_sequence_file(path):
+    """Determines if ``path`` names a (possibly compressed) FASTA or FASTQ
+    file.
+
+    """
+    return strip_compression(path).endswith(FASTA_EXTENSIONS +
+                                            FASTQ_EXTENSIONS)
+
+
+def sample_name_from_file(path):
+    """Gets the sample name implied by a sequence file name, e.g.
+    ``sample1.fastq.gz`` gives ``sample1``.
+
+    """
+    return os.path.splitext(strip_compression(os.path.basename(path)))[0]
+
+
+class ReadAheadFile(object):
+    """Reads a compressed file on a background thread so decompression
+    overlaps with parsing.  Iterating yields lines without trailing newlines.
+
+    :param file fh: A file-like object with a ``read`` method
+    :param int chunk_size: The number of bytes to read at a time
+    :param int max_chunks: The maximum number of chunks to buffer
+
+    """
+    def __init__(self, fh, chunk_size=4 * 1024 * 1024, max_chunks=8):
+        self._fh = fh
+        self._chunk_size = chunk_size
+        self._queue = Queue.Queue(maxsize=max_chunks)
+        self._closed = False
+        self._thread = threading.Thread(target=self._read)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _read(self):
+        try:
+            while not self._closed:
+                chunk = self._fh.read(self._chunk_size)
+                self._queue.put(chunk)
+                if not chunk:
+                    break
+        except Exception as e:
+            self._queue.put(e)
+
+    def __iter__(self):
+        remainder = ''
+        while True:
+            chunk = self._queue.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                break
+            lines = (remainder + chunk).split('\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line.rstrip('\r')
+        if remainder:
+            yield remainder.rstrip('\r')
+
+    def close(self):
+        self._closed = True
+        # Unblock the reader thread if it is waiting on a full queue
+        while self._thread.is_alive():
+            try:
+                self._queue.get_nowait()
+            except Queue.Empty:
+                self._thread.join(.1)
+        self._fh.close()
+
+
+class _PlainFile(object):
+    def __init__(self, fh):
+        self._fh = fh
+
+    def __iter__(self):
+        for line in self._fh:
+            yield line.rstrip('\r\n')
+
+    def close(self):
+        self._fh.close()
+
+
+def open_lines(path):
+    """Opens a plain, gzip, or bzip2 compressed file for line iteration.
+    Compressed files are decompressed on a read-ahead thread.
+
+    :param str path: The path to the file
+
+    :returns: An iterable of lines with a ``close`` method
+
+    """
+    if path.endswith('.gz'):
+        return ReadAheadFile(gzip.open(path, 'rb'))
+    elif path.endswith('.bz2'):
+        return ReadAheadFile(bz2.BZ2File(path, 'rb'))
+    return _PlainFile(open(path, 'rU'))
+
+
+def read_fasta(lines):
+    """Parses FASTA records from an iterable of lines.
+
+    :returns: A generator of ``(id, sequence, None)`` tuples
+
+    """
+    seq_id, seq = None, []
+    for line in lines:
+        if line.startswith('>'):
+            if seq_id is not None:
+                yield seq_id, ''.join(seq), None
+            seq_id, seq = line[1:].rstrip(), []
+        elif seq_id is not None:
+            seq.append(line.strip().replace(' ', ''))
+    if seq_id is not None:
+        yield seq_id, ''.join(seq), None
+
+
+def read_fastq(lines):
+    """Parses FASTQ records from an iterable of lines.  Sequences and
+    qualities may span multiple lines.
+
+    :returns: A generator of ``(id, sequence, quality)`` tuples where
+        ``quality`` is the Sanger encoded quality string
+
+    """
+    lines = iter(lines)
+    for line in lines:
+        if not line:
+            continue
+        if not line.startswith('@'):
+            raise ValueError('Records in FASTQ files should start with "@"')
+        seq_id = line[1:].rstrip()
+        seq = []
+        for line in lines:
+            if line.startswith('+'):
+                break
+            seq.append(line.strip())
+        else:
+            raise ValueError('End of file without quality for {}'.format(
+                seq_id))
+        seq = ''.join(seq)
+        qual = []
+        qual_len = 0
+        while qual_len < len(seq):
+            try:
+                line = next(lines).rstrip()
+            except StopIteration:
+                break
+            qual.append(line)
+            qual_len += len(line)
+        qual = ''.join(qual)
+        if len(qual) != len(seq):
+            raise ValueError('Lengths of sequence and quality differ for '
+                             '{}'.format(seq_id))
+        yield seq_id, seq, qual
+
+
+def read_sequences(path):
+    """Reads all records from a (possibly compressed) FASTA or FASTQ file.
+    The format is determined from the file extension; files not ending in a
+    FASTA extension are assumed to be FASTQ.
+
+    :param str path: The path to the file
+
+    :returns: A generator of ``(id, sequence, quality)`` tuples.  For FASTA
+        files ``quality`` is ``None``.
+
+    """
+    handle = open_lines(path)
+    try:
+        if strip_compression(path).endswith(FASTA_EXTENSIONS):
+            parser = read_fasta(handle)
+        else:
+            parser = read_fastq(handle)
+        for record in parser:
+            yield record
+    finally:
+        handle.close()
@@ -1,3 +1,4 @@
+#include <stdint.h>
 #include <string.h>
 #include <Python.h>
 
@@ -72,11 +73,753 @@ dnautils_hamming(PyObject *self, PyObject *args)
     return Py_BuildValue("I", distance);
 }
 
+static inline int
+is_mismatch(char c1, char c2)
+{
+    return c1 != c2 && c1 != 'N' && c2 != 'N' && c1 != '-' && c2 != '-';
+}
+
+static int
+parse_windows(PyObject *args, char **str1, char **str2, Py_ssize_t *len,
+              int *window, double *threshold)
+{
+    PyObject *s1, *s2;
+
+    if (!PyArg_ParseTuple(args, "SSid", &s1, &s2, window, threshold)) {
+        return 0;
+    }
+
+    if (PyString_Size(s1) != PyString_Size(s2)) {
+        PyErr_SetString(DNAUtilError, "Sequences have unequal lengths.");
+        return 0;
+    }
+    if (*window <= 0) {
+        PyErr_SetString(DNAUtilError, "Window size must be positive.");
+        return 0;
+    }
+
+    if ((*str1 = PyString_AsString(s1)) == NULL) {
+        return 0;
+    }
+    if ((*str2 = PyString_AsString(s2)) == NULL) {
+        return 0;
+    }
+    *len = PyString_Size(s1);
+    return 1;
+}
+
+static PyObject*
+dnautils_window_hamming_exceeds(PyObject *self, PyObject *args)
+{
+    char *str1, *str2;
+    Py_ssize_t len, i;
+    int window;
+    double threshold;
+    long distance = 0;
+
+    if (!parse_windows(args, &str1, &str2, &len, &window, &threshold)) {
+        return NULL;
+    }
+
+    for (i = 0; i < len; i++) {
+        distance += is_mismatch(str1[i], str2[i]);
+        if (i >= window) {
+            distance -= is_mismatch(str1[i - window], str2[i - window]);
+        }
+        if (i >= window - 1 && distance >= threshold) {
+            return Py_BuildValue("O", Py_True);
+        }
+    }
+    return Py_BuildValue("O", Py_False);
+}
+
+/*
+ * A list of strings whose buffers may be read without the GIL.  The strings
+ * are held by a tuple so they cannot be freed while the GIL is released.
+ */
+typedef struct {
+    PyObject *tuple;
+    Py_ssize_t size;
+    char **strs;
+    Py_ssize_t *lens;
+} StringList;
+
+static int
+string_list_init(StringList *list, PyObject *obj)
+{
+    Py_ssize_t i;
+    PyObject *item;
+
+    list->strs = NULL;
+    list->lens = NULL;
+    if ((list->tuple = PySequence_Tuple(obj)) == NULL) {
+        return 0;
+    }
+    list->size = PyTuple_GET_SIZE(list->tuple);
+    list->strs = PyMem_New(char *, list->size + 1);
+    list->lens = PyMem_New(Py_ssize_t, list->size + 1);
+    if (list->strs == NULL || list->lens == NULL) {
+        PyErr_NoMemory();
+        return 0;
+    }
+
+    for (i = 0; i < list->size; i++) {
+        item = PyTuple_GET_ITEM(list->tuple, i);
+        if (!PyString_Check(item)) {
+            PyErr_SetString(PyExc_TypeError, "Sequences must be strings.");
+            return 0;
+        }
+        list->strs[i] = PyString_AS_STRING(item);
+        list->lens[i] = PyString_GET_SIZE(item);
+    }
+    return 1;
+}
+
+static void
+string_list_free(StringList *list)
+{
+    PyMem_Free(list->strs);
+    PyMem_Free(list->lens);
+    Py_XDECREF(list->tuple);
+}
+
+static int
+check_lengths(StringList *list, Py_ssize_t len)
+{
+    Py_ssize_t i;
+
+    for (i = 0; i < list->size; i++) {
+        if (list->lens[i] != len) {
+            PyErr_SetString(DNAUtilError, "Sequences have unequal lengths.");
+            return 0;
+        }
+    }
+    return 1;
+}
+
+/*
+ * Counts mismatches as in hamming.  If max_distance is non-negative counting
+ * stops once it is exceeded.
+ */
+static long
+bounded_hamming(const char *str1, const char *str2, Py_ssize_t len,
+                long max_distance)
+{
+    Py_ssize_t i;
+    long distance = 0;
+
+    for (i = 0; i < len; i++) {
+        distance += is_mismatch(str1[i], str2[i]);
+        if (max_distance >= 0 && distance > max_distance) {
+            break;
+        }
+    }
+    return distance;
+}
+
+static int
+is_equal(const char *str1, const char *str2, Py_ssize_t len)
+{
+    Py_ssize_t i;
+
+    for (i = 0; i < len; i++) {
+        if (str1[i] != str2[i] && str1[i] != 'N' && str2[i] != 'N') {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+static PyObject*
+long_array_to_list(long *values, Py_ssize_t size)
+{
+    Py_ssize_t i;
+    PyObject *list, *value;
+
+    if ((list = PyList_New(size)) == NULL) {
+        return NULL;
+    }
+    for (i = 0; i < size; i++) {
+        if ((value = PyInt_FromLong(values[i])) == NULL) {
+            Py_DECREF(list);
+            return NULL;
+        }
+        PyList_SET_ITEM(list, i, value);
+    }
+    return list;
+}
+
+static PyObject*
+dnautils_hamming_many(PyObject *self, PyObject *args)
+{
+    char *str;
+    int len;
+    long max_distance = -1;
+    long *distances;
+    Py_ssize_t i;
+    PyObject *others, *result = NULL;
+    StringList list;
+
+    if (!PyArg_ParseTuple(args, "s#O|l", &str, &len, &others,
+                          &max_distance)) {
+        return NULL;
+    }
+    if (!string_list_init(&list, others) || !check_lengths(&list, len)) {
+        string_list_free(&list);
+        return NULL;
+    }
+    if ((distances = PyMem_New(long, list.size + 1)) == NULL) {
+        string_list_free(&list);
+        return PyErr_NoMemory();
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < list.size; i++) {
+        distances[i] = bounded_hamming(str, list.strs[i], len, max_distance);
+    }
+    Py_END_ALLOW_THREADS
+
+    result = long_array_to_list(distances, list.size);
+    PyMem_Free(distances);
+    string_list_free(&list);
+    return result;
+}
+
+static PyObject*
+dnautils_hamming_matrix(PyObject *self, PyObject *args)
+{
+    long *distances;
+    Py_ssize_t i, j;
+    PyObject *seqs, *others = NULL, *row, *result = NULL;
+    StringList rows, cols;
+
+    if (!PyArg_ParseTuple(args, "O|O", &seqs, &others)) {
+        return NULL;
+    }
+    if (!string_list_init(&rows, seqs)) {
+        string_list_free(&rows);
+        return NULL;
+    }
+    if (!string_list_init(&cols, others == NULL ? seqs : others) ||
+            (rows.size > 0 && (!check_lengths(&rows, rows.lens[0]) ||
+                               !check_lengths(&cols, rows.lens[0]))) ||
+            (rows.size == 0 && cols.size > 0 &&
+             !check_lengths(&cols, cols.lens[0]))) {
+        string_list_free(&rows);
+        string_list_free(&cols);
+        return NULL;
+    }
+    if ((distances = PyMem_New(long, rows.size * cols.size + 1)) == NULL) {
+        string_list_free(&rows);
+        string_list_free(&cols);
+        return PyErr_NoMemory();
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < rows.size; i++) {
+        for (j = 0; j < cols.size; j++) {
+            distances[i * cols.size + j] = bounded_hamming(
+                rows.strs[i], cols.strs[j], rows.lens[i], -1);
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    if ((result = PyList_New(rows.size)) != NULL) {
+        for (i = 0; i < rows.size; i++) {
+            row = long_array_to_list(distances + i * cols.size, cols.size);
+            if (row == NULL) {
+                Py_CLEAR(result);
+                break;
+            }
+            PyList_SET_ITEM(result, i, row);
+        }
+    }
+    PyMem_Free(distances);
+    string_list_free(&rows);
+    string_list_free(&cols);
+    return result;
+}
+
+static PyObject*
+dnautils_equal_any(PyObject *self, PyObject *args)
+{
+    char *str;
+    int len;
+    Py_ssize_t i, found = -1;
+    PyObject *others;
+    StringList list;
+
+    if (!PyArg_ParseTuple(args, "s#O", &str, &len, &others)) {
+        return NULL;
+    }
+    if (!string_list_init(&list, others)) {
+        string_list_free(&list);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < list.size; i++) {
+        if (list.lens[i] == len && is_equal(str, list.strs[i], len)) {
+            found = i;
+            break;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    string_list_free(&list);
+    return Py_BuildValue("n", found);
+}
+
+/*
+ * Finds the window of any sequence with the minimum hamming distance to any
+ * germline.  Germlines are searched in order, then the sequences for each,
+ * then the positions in each sequence, and the first window with the minimum
+ * distance is kept.  Each window is only compared until it cannot be closer
+ * than the best so far.  The search stops once a distance of at most floor is
+ * found.  If max_distance is non-negative, windows farther than it are
+ * ignored.
+ */
+static PyObject*
+dnautils_min_hamming_windows(PyObject *self, PyObject *args)
+{
+    PyObject *seqs_obj, *germs_obj;
+    long floor = 0, max_distance = -1, bound, distance, best_distance = -1;
+    Py_ssize_t g, s, pos, best_germ = -1, best_seq = -1, best_pos = -1;
+    int done = 0;
+    StringList seqs, germs;
+
+    if (!PyArg_ParseTuple(args, "OO|ll", &seqs_obj, &germs_obj, &floor,
+                          &max_distance)) {
+        return NULL;
+    }
+    if (!string_list_init(&seqs, seqs_obj)) {
+        string_list_free(&seqs);
+        return NULL;
+    }
+    if (!string_list_init(&germs, germs_obj)) {
+        string_list_free(&seqs);
+        string_list_free(&germs);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (g = 0; g < germs.size && !done; g++) {
+        for (s = 0; s < seqs.size && !done; s++) {
+            for (pos = 0; pos + germs.lens[g] <= seqs.lens[s]; pos++) {
+                bound = best_distance >= 0 ? best_distance - 1 : max_distance;
+                distance = bounded_hamming(seqs.strs[s] + pos, germs.strs[g],
+                                           germs.lens[g], bound);
+                if (bound >= 0 && distance > bound) {
+                    continue;
+                }
+                best_germ = g;
+                best_seq = s;
+                best_pos = pos;
+                best_distance = distance;
+                if (best_distance <= floor || best_distance == 0) {
+                    done = 1;
+                    break;
+                }
+            }
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    string_list_free(&seqs);
+    string_list_free(&germs);
+    if (best_distance < 0) {
+        Py_RETURN_NONE;
+    }
+    return Py_BuildValue("nnnl", best_germ, best_seq, best_pos,
+                         best_distance);
+}
+
+/*
+ * Packed sequences hold 2 bits per base in 64-bit words, 32 bases per word,
+ * with A, C, G, T as 0 to 3.  A second set of words holds one bit per base
+ * which is set for N and gap positions, 64 bases per word.  Ns are stored
+ * with a base of 0 and gaps with a base of 1 so the two can be told apart.
+ *
+ * The packed string is the number of bases followed by the base words then
+ * the mask words, all as native 64-bit integers.
+ */
+#define EVEN_BITS 0x5555555555555555ULL
+
+typedef struct {
+    Py_ssize_t len;
+    Py_ssize_t num_words;
+    const char *bases;
+    const char *masks;
+} PackedSeq;
+
+static inline uint64_t
+load_word(const char *buf, Py_ssize_t i)
+{
+    uint64_t word;
+    memcpy(&word, buf + i * sizeof(uint64_t), sizeof(uint64_t));
+    return word;
+}
+
+static inline Py_ssize_t
+packed_size(Py_ssize_t len)
+{
+    return sizeof(uint64_t) * (1 + (len + 31) / 32 + (len + 63) / 64);
+}
+
+/* Moves the low 32 bits of x to the even bits. */
+static inline uint64_t
+spread_bits(uint64_t x)
+{
+    x &= 0xFFFFFFFFULL;
+    x = (x | (x << 16)) & 0x0000FFFF0000FFFFULL;
+    x = (x | (x << 8)) & 0x00FF00FF00FF00FFULL;
+    x = (x | (x << 4)) & 0x0F0F0F0F0F0F0F0FULL;
+    x = (x | (x << 2)) & 0x3333333333333333ULL;
+    x = (x | (x << 1)) & EVEN_BITS;
+    return x;
+}
+
+/* Gets the mask for the bases in base word i on the even bits. */
+static inline uint64_t
+load_mask(const PackedSeq *seq, Py_ssize_t i)
+{
+    return spread_bits(load_word(seq->masks, i / 2) >> (32 * (i % 2)));
+}
+
+static int
+packed_from_object(PyObject *obj, PackedSeq *seq)
+{
+    const char *buf;
+    uint64_t len;
+
+    if (!PyString_Check(obj)) {
+        PyErr_SetString(PyExc_TypeError, "Packed sequences must be strings.");
+        return 0;
+    }
+    buf = PyString_AS_STRING(obj);
+    if (PyString_GET_SIZE(obj) < (Py_ssize_t)sizeof(uint64_t)) {
+        PyErr_SetString(DNAUtilError, "Invalid packed sequence.");
+        return 0;
+    }
+    memcpy(&len, buf, sizeof(uint64_t));
+    if (len > PY_SSIZE_T_MAX / 2 ||
+            PyString_GET_SIZE(obj) != packed_size((Py_ssize_t)len)) {
+        PyErr_SetString(DNAUtilError, "Invalid packed sequence.");
+        return 0;
+    }
+    seq->len = (Py_ssize_t)len;
+    seq->num_words = (seq->len + 31) / 32;
+    seq->bases = buf + sizeof(uint64_t);
+    seq->masks = seq->bases + seq->num_words * sizeof(uint64_t);
+    return 1;
+}
+
+/* Gets the bases which differ on the even bits. */
+static inline uint64_t
+base_diff(const PackedSeq *seq1, const PackedSeq *seq2, Py_ssize_t i)
+{
+    uint64_t diff = load_word(seq1->bases, i) ^ load_word(seq2->bases, i);
+    return (diff | (diff >> 1)) & EVEN_BITS;
+}
+
+/* Compares as in equal; gaps only equal gaps. */
+static int
+packed_is_equal(const PackedSeq *seq1, const PackedSeq *seq2)
+{
+    Py_ssize_t i;
+    uint64_t mask1, mask2, ns1, ns2;
+
+    for (i = 0; i < seq1->num_words; i++) {
+        mask1 = load_mask(seq1, i);
+        mask2 = load_mask(seq2, i);
+        ns1 = mask1 & ~load_word(seq1->bases, i);
+        ns2 = mask2 & ~load_word(seq2->bases, i);
+        if ((base_diff(seq1, seq2, i) | (mask1 ^ mask2)) & ~ns1 & ~ns2) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+static PyObject*
+dnautils_pack(PyObject *self, PyObject *args)
+{
+    char *str, *buf;
+    int len;
+    Py_ssize_t i, num_words;
+    uint64_t code, mask, header, *bases, *masks;
+    PyObject *result;
+
+    if (!PyArg_ParseTuple(args, "s#", &str, &len)) {
+        return NULL;
+    }
+
+    num_words = (len + 31) / 32;
+    bases = PyMem_New(uint64_t, num_words + (len + 63) / 64 + 1);
+    if (bases == NULL) {
+        return PyErr_NoMemory();
+    }
+    masks = bases + num_words;
+    memset(bases, 0, sizeof(uint64_t) * (num_words + (len + 63) / 64));
+
+    for (i = 0; i < len; i++) {
+        mask = 0;
+        switch (str[i]) {
+            case 'A': code = 0; break;
+            case 'C': code = 1; break;
+            case 'G': code = 2; break;
+            case 'T': code = 3; break;
+            case 'N': code = 0; mask = 1; break;
+            case '-': code = 1; mask = 1; break;
+            default:
+                PyMem_Free(bases);
+                PyErr_SetString(DNAUtilError,
+                                "Invalid character in sequence.");
+                return NULL;
+        }
+        bases[i / 32] |= code << (2 * (i % 32));
+        masks[i / 64] |= mask << (i % 64);
+    }
+
+    result = PyString_FromStringAndSize(NULL, packed_size(len));
+    if (result != NULL) {
+        buf = PyString_AS_STRING(result);
+        header = len;
+        memcpy(buf, &header, sizeof(uint64_t));
+        memcpy(buf + sizeof(uint64_t), bases,
+               packed_size(len) - sizeof(uint64_t));
+    }
+    PyMem_Free(bases);
+    return result;
+}
+
+static PackedSeq*
+packed_list_init(StringList *list)
+{
+    Py_ssize_t i;
+    PackedSeq *seqs;
+
+    if ((seqs = PyMem_New(PackedSeq, list->size + 1)) == NULL) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+    for (i = 0; i < list->size; i++) {
+        if (!packed_from_object(PyTuple_GET_ITEM(list->tuple, i), &seqs[i])) {
+            PyMem_Free(seqs);
+            return NULL;
+        }
+    }
+    return seqs;
+}
+
+static PyObject*
+dnautils_packed_equal_many(PyObject *self, PyObject *args)
+{
+    long *equal;
+    Py_ssize_t i;
+    PyObject *packed, *others, *result = NULL, *value;
+    PackedSeq seq, *seqs = NULL;
+    StringList list;
+
+    if (!PyArg_ParseTuple(args, "OO", &packed, &others) ||
+            !packed_from_object(packed, &seq)) {
+        return NULL;
+    }
+    if (!string_list_init(&list, others) ||
+            (seqs = packed_list_init(&list)) == NULL) {
+        string_list_free(&list);
+        return NULL;
+    }
+    if ((equal = PyMem_New(long, list.size + 1)) == NULL) {
+        PyMem_Free(seqs);
+        string_list_free(&list);
+        return PyErr_NoMemory();
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < list.size; i++) {
+        equal[i] = seqs[i].len == seq.len && packed_is_equal(&seq, &seqs[i]);
+    }
+    Py_END_ALLOW_THREADS
+
+    if ((result = PyList_New(list.size)) != NULL) {
+        for (i = 0; i < list.size; i++) {
+            value = equal[i] ? Py_True : Py_False;
+            Py_INCREF(value);
+            PyList_SET_ITEM(result, i, value);
+        }
+    }
+    PyMem_Free(equal);
+    PyMem_Free(seqs);
+    string_list_free(&list);
+    return result;
+}
+
+static PyObject*
+dnautils_kmer_counts(PyObject *self, PyObject *args)
+{
+    const char *seq, *offsets_buf, *rows_buf;
+    int seq_len, offsets_size, rows_size, k, num_rows, error = 0;
+    Py_ssize_t i, num_kmers, num_entries;
+    int64_t start, end, row, *counts;
+    const int64_t *offsets, *rows;
+    uint64_t code = 0, mask;
+    int valid = 0, nt;
+    PyObject *result;
+
+    if (!PyArg_ParseTuple(args, "s#is#s#i", &seq, &seq_len, &k,
+                          &offsets_buf, &offsets_size, &rows_buf, &rows_size,
+                          &num_rows)) {
+        return NULL;
+    }
+    if (k <= 0 || k > 15 || num_rows < 0) {
+        PyErr_SetString(DNAUtilError, "Invalid k-mer index.");
+        return NULL;
+    }
+    num_kmers = (Py_ssize_t)1 << (2 * k);
+    if (offsets_size != (num_kmers + 1) * (Py_ssize_t)sizeof(int64_t) ||
+            rows_size % sizeof(int64_t) != 0) {
+        PyErr_SetString(DNAUtilError, "Invalid k-mer index.");
+        return NULL;
+    }
+    offsets = (const int64_t *)offsets_buf;
+    rows = (const int64_t *)rows_buf;
+    num_entries = rows_size / sizeof(int64_t);
+    mask = num_kmers - 1;
+
+    if ((counts = PyMem_New(int64_t, num_rows + 1)) == NULL) {
+        return PyErr_NoMemory();
+    }
+    memset(counts, 0, sizeof(int64_t) * (num_rows + 1));
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < seq_len && !error; i++) {
+        switch (seq[i]) {
+            case 'A': nt = 0; break;
+            case 'C': nt = 1; break;
+            case 'G': nt = 2; break;
+            case 'T': nt = 3; break;
+            default: nt = -1; break;
+        }
+        if (nt < 0) {
+            valid = 0;
+            continue;
+        }
+        code = ((code << 2) | nt) & mask;
+        if (++valid < k) {
+            continue;
+        }
+        start = offsets[code];
+        end = offsets[code + 1];
+        if (start < 0 || start > end || end > num_entries) {
+            error = 1;
+            break;
+        }
+        for (; start < end; start++) {
+            row = rows[start];
+            if (row < 0 || row >= num_rows) {
+                error = 1;
+                break;
+            }
+            counts[row]++;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    if (error) {
+        PyMem_Free(counts);
+        PyErr_SetString(DNAUtilError, "Invalid k-mer index.");
+        return NULL;
+    }
+    result = PyString_FromStringAndSize((const char *)counts,
+                                        sizeof(int64_t) * num_rows);
+    PyMem_Free(counts);
+    return result;
+}
+
+static PyObject*
+dnautils_strand_votes(PyObject *self, PyObject *args)
+{
+    const char *seq, *presence;
+    int seq_len, presence_size, k;
+    Py_ssize_t i;
+    long forward = 0, reverse = 0;
+    uint64_t code = 0, rc_code = 0, mask;
+    int valid = 0, nt;
+
+    if (!PyArg_ParseTuple(args, "s#is#", &seq, &seq_len, &k, &presence,
+                          &presence_size)) {
+        return NULL;
+    }
+    if (k <= 0 || k > 15 || presence_size != (1 << (2 * k))) {
+        PyErr_SetString(DNAUtilError, "Invalid k-mer presence table.");
+        return NULL;
+    }
+    mask = presence_size - 1;
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < seq_len; i++) {
+        switch (seq[i]) {
+            case 'A': nt = 0; break;
+            case 'C': nt = 1; break;
+            case 'G': nt = 2; break;
+            case 'T': nt = 3; break;
+            default: nt = -1; break;
+        }
+        if (nt < 0) {
+            valid = 0;
+            continue;
+        }
+        /* The reverse complement k-mer gains the complement of each
+         * nucleotide at its start */
+        code = ((code << 2) | nt) & mask;
+        rc_code = (rc_code >> 2) | ((uint64_t)(3 - nt) << (2 * (k - 1)));
+        if (++valid >= k) {
+            forward += presence[code] != 0;
+            reverse += presence[rc_code] != 0;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    return Py_BuildValue("ll", forward, reverse);
+}
+
 static PyMethodDef DNAUtilsMethods[] = {
     {"equal", dnautils_equal, METH_VARARGS,
         "Checks if two sequences are equal."},
     {"hamming", dnautils_hamming, METH_VARARGS,
         "Gets the hamming distance between two sequences."},
+    {"window_hamming_exceeds", dnautils_window_hamming_exceeds, METH_VARARGS,
+        "Checks if any window of two sequences has a hamming distance of at "
+        "least a threshold."},
+    {"hamming_many", dnautils_hamming_many, METH_VARARGS,
+        "Gets the hamming distance between a sequence and each of a list of "
+        "sequences, optionally stopping once a maximum distance is "
+        "exceeded."},
+    {"hamming_matrix", dnautils_hamming_matrix, METH_VARARGS,
+        "Gets the hamming distance between every pair of sequences from two "
+        "lists, or within one list."},
+    {"equal_any", dnautils_equal_any, METH_VARARGS,
+        "Gets the index of the first sequence in a list equal to a sequence "
+        "or -1 if there is none."},
+    {"min_hamming_windows", dnautils_min_hamming_windows, METH_VARARGS,
+        "Gets the germline index, sequence index, position and distance of "
+        "the window of any of a list of sequences with the minimum hamming "
+        "distance to any of a list of germlines, optionally stopping once a "
+        "distance floor is reached and ignoring windows beyond a maximum "
+        "distance."},
+    {"pack", dnautils_pack, METH_VARARGS,
+        "Packs a sequence of A, C, G, T, N and - into 2 bits per base with a "
+        "mask of Ns and gaps."},
+    {"packed_equal_many", dnautils_packed_equal_many, METH_VARARGS,
+        "Checks if a packed sequence is equal to each of a list of packed "
+        "sequences."},
+    {"kmer_counts", dnautils_kmer_counts, METH_VARARGS,
+        "Counts the k-mers of a sequence in each row of a k-mer index.  "
+        "The counts are returned as native 64-bit integers."},
+    {"strand_votes", dnautils_strand_votes, METH_VARARGS,
+        "Counts the k-mers of a sequence and of its reverse complement which "
+        "are in a k-mer presence table."},
     {NULL, NULL, 0, NULL}
 };
 
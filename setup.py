@@ -22,6 +22,7 @@ setup(
     ],
     scripts=[
         'bin/immunedb_admin',
+        'bin/immunedb_benchmark',
         'bin/immunedb_clones',
         'bin/immunedb_clone_import',
         'bin/immunedb_clone_stats',
@@ -36,6 +37,7 @@ setup(
         'bin/immunedb_rest',
         'bin/immunedb_sample_stats',
         'bin/immunedb_sql',
+        'bin/immunedb_synthetic',
     ],
     install_requires=[
         'gevent',
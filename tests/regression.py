@@ -127,6 +127,7 @@ class BaseTest(object):
                     upstream_of_cdr3=31,
                     max_deletions=5,
                     max_insertions=5,
+                    germline_cache=None,
                 )
             )
             self.session.commit()
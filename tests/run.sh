@@ -20,6 +20,12 @@ fi
 setup
 coverage erase
 coverage run --source=immunedb -p -m nose -s tests/tests_parser.py
+coverage run --source=immunedb -p -m nose -s tests/tests_reader.py
+coverage run --source=immunedb -p -m nose -s tests/tests_dedup.py
+coverage run --source=immunedb -p -m nose -s tests/tests_dnautils.py
+coverage run --source=immunedb -p -m nose -s tests/tests_genes.py
+coverage run --source=immunedb -p -m nose -s tests/tests_writer.py
+coverage run --source=immunedb -p -m nose -s tests/tests_identification.py
 coverage run --source=immunedb -p -m nose -s tests/tests_import.py
 coverage run --source=immunedb -p -m nose -s tests/tests_pipeline.py
 coverage run --source=immunedb --concurrency=gevent -p -m nose -s tests/run_server.py &
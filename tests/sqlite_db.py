@@ -0,0 +1,75 @@
+import os
+
+from sqlalchemy import (create_engine, Date, MetaData,
+                        PrimaryKeyConstraint)
+from sqlalchemy.dialects.mysql import MEDIUMTEXT
+from sqlalchemy.dialects.sqlite import DATE
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+
+import immunedb.common.config as config
+from immunedb.common.models import Base
+
+
+@compiles(MEDIUMTEXT, 'sqlite')
+def _compile_mediumtext(element, compiler, **kw):
+    return 'TEXT'
+
+
+class _Date(DATE):
+    # MySQL accepts dates as strings, as read from metadata files
+    def bind_processor(self, dialect):
+        process = super(_Date, self).bind_processor(dialect)
+
+        def _process(value):
+            if isinstance(value, basestring):
+                return value
+            return process(value)
+        return _process
+
+
+def _get_metadata():
+    # SQLite only auto-increments a lone INTEGER PRIMARY KEY, so sequences are
+    # keyed by their auto-increment value alone.  The unique constraints on
+    # (sample_id, ai) and (sample_id, seq_id) are kept.
+    metadata = MetaData()
+    for table in Base.metadata.sorted_tables:
+        table.tometadata(metadata)
+    sequences = metadata.tables['sequences']
+    sequences.c.sample_id.primary_key = False
+    sequences.constraints.discard(sequences.primary_key)
+    PrimaryKeyConstraint(sequences.c.ai)._set_parent_with_dispatch(sequences)
+    return metadata
+
+
+def init_db(path, drop_all=False, as_maker=False, create=True):
+    """Initializes a session with a SQLite database at ``path``, taking the
+    same arguments as :py:func:`immunedb.common.config.init_db`.
+
+    """
+    if drop_all and os.path.exists(path):
+        os.remove(path)
+    engine = create_engine('sqlite:///{}'.format(path))
+    engine.dialect.colspecs = dict(engine.dialect.colspecs)
+    engine.dialect.colspecs[Date] = _Date
+    if create:
+        _get_metadata().create_all(engine)
+    session = sessionmaker()
+    session.configure(bind=engine)
+    return session if as_maker else session()
+
+
+def use_sqlite():
+    """Makes :py:func:`immunedb.common.config.init_db` open SQLite databases
+    so that code which connects by configuration path, including processes
+    started afterwards, can be tested without a MySQL server.
+
+    :returns: A function which restores the original ``init_db``
+
+    """
+    original = config.init_db
+    config.init_db = init_db
+
+    def restore():
+        config.init_db = original
+    return restore
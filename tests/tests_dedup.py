@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from immunedb.identification.dedup import UniqueSequences
+from immunedb.util.reader import read_sequences
+
+FASTQ_PATH = os.path.join('tests', 'data', 'identification', 'input.fastq')
+
+
+class DedupTest(unittest.TestCase):
+    def collapse(self, max_memory):
+        uniques = UniqueSequences(max_memory).add_all(
+            read_sequences(FASTQ_PATH))
+        return uniques, [(v.sequence, v.quality, v.ids) for v in uniques]
+
+    def test_spill(self):
+        in_memory, expected = self.collapse(None)
+        assert not in_memory.spilled
+        spilled, collapsed = self.collapse(10000)
+        assert spilled.spilled
+        assert len(spilled) == len(expected)
+        assert collapsed == expected
+        assert [c[0] for c in collapsed] == sorted(c[0] for c in collapsed)
+
+    def test_invalid(self):
+        uniques = UniqueSequences()
+        uniques.add('a', 'ATCG', 'IIII')
+        uniques.add('b', 'ATXG', 'IIII')
+        uniques.add('c', 'ATCG', 'JJJJ')
+        collapsed = list(uniques)
+        assert len(collapsed) == 1
+        assert collapsed[0].ids == ['a', 'c']
+        assert collapsed[0].quality == 'IIII'
+
+    def test_sample(self):
+        uniques = UniqueSequences(sample_size=10).add_all(
+            read_sequences(FASTQ_PATH))
+        sampled = [v.sequence for v in uniques.sample]
+        assert len(sampled) == 10
+        assert len(set(sampled)) == 10
+        assert set(sampled) <= set(v.sequence for v in uniques)
+
+    def test_cleanup(self):
+        def failing_reads():
+            for i, read in enumerate(read_sequences(FASTQ_PATH)):
+                if i == 500:
+                    raise IOError('Truncated file')
+                yield read
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            # Spill files are removed if reading fails part way through
+            with self.assertRaises(IOError):
+                with UniqueSequences(10000, temp_dir) as uniques:
+                    uniques.add_all(failing_reads())
+            assert uniques.spilled
+            assert os.listdir(temp_dir) == []
+
+            # And if the sequences are never iterated
+            with UniqueSequences(10000, temp_dir) as uniques:
+                uniques.add_all(read_sequences(FASTQ_PATH))
+                assert len(uniques) > 0
+                assert os.listdir(temp_dir) != []
+            assert os.listdir(temp_dir) == []
+        finally:
+            shutil.rmtree(temp_dir)
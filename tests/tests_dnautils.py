@@ -0,0 +1,205 @@
+import random
+import struct
+import unittest
+
+import dnautils
+
+from immunedb.util.funcs import get_equal_many
+
+
+def hamming(seq1, seq2):
+    return sum(1 for c1, c2 in zip(seq1, seq2)
+               if c1 != c2 and 'N' not in (c1, c2) and '-' not in (c1, c2))
+
+
+def equal(seq1, seq2):
+    return len(seq1) == len(seq2) and all(
+        c1 == c2 or 'N' in (c1, c2) for c1, c2 in zip(seq1, seq2))
+
+
+def has_window_exceeding(germ, seq, window, threshold):
+    # The loop VDJAlignment.has_possible_indel used before
+    # window_hamming_exceeds
+    for i in range(0, len(germ) - window + 1):
+        if dnautils.hamming(germ[i:i + window],
+                            seq[i:i + window]) >= threshold:
+            return True
+    return False
+
+
+def unpack(packed):
+    # Decodes the 2-bit bases and the mask of Ns and gaps written by pack
+    length = struct.unpack('=Q', packed[:8])[0]
+    num_words = (length + 31) // 32
+    words = struct.unpack('={}Q'.format(len(packed) // 8 - 1), packed[8:])
+    bases, masks = words[:num_words], words[num_words:]
+    assert len(masks) == (length + 63) // 64
+    seq = []
+    for i in range(length):
+        code = (bases[i // 32] >> (2 * (i % 32))) & 3
+        if (masks[i // 64] >> (i % 64)) & 1:
+            seq.append('N-'[code])
+        else:
+            seq.append('ACGT'[code])
+    return ''.join(seq)
+
+
+def min_hamming_windows(seqs, germs, floor=0, max_distance=-1):
+    best = None
+    for g, germ in enumerate(germs):
+        for s, seq in enumerate(seqs):
+            for pos in range(len(seq) - len(germ) + 1):
+                distance = hamming(seq[pos:pos + len(germ)], germ)
+                if max_distance >= 0 and distance > max_distance:
+                    continue
+                if best is None or distance < best[3]:
+                    best = (g, s, pos, distance)
+                    if distance <= floor:
+                        return best
+    return best
+
+
+class DNAUtilsTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def random_seqs(self, count, length, alphabet='ACGTN-'):
+        return [''.join(self.rng.choice(alphabet) for _ in range(length))
+                for _ in range(count)]
+
+    def test_window_hamming_exceeds(self):
+        for length in (0, 1, 5, 29, 30, 31, 60, 300):
+            germ = self.random_seqs(1, length, 'ACGT')[0]
+            for seq in self.random_seqs(20, length):
+                for window, threshold in ((30, 18), (30, 5), (10, 2.5),
+                                          (1, 1), (5, 0), (3, 4)):
+                    assert dnautils.window_hamming_exceeds(
+                        germ, seq, window, threshold) == has_window_exceeding(
+                            germ, seq, window, threshold)
+
+        # Mismatches only within the first or last window
+        germ = 'A' * 40
+        for seq in ('TTT' + 'A' * 37, 'A' * 37 + 'TTT', 'T' + 'A' * 38 + 'T'):
+            for window in (3, 4, 10, 40, 41):
+                for threshold in (2, 3):
+                    assert dnautils.window_hamming_exceeds(
+                        germ, seq, window, threshold) == has_window_exceeding(
+                            germ, seq, window, threshold)
+        assert dnautils.window_hamming_exceeds(germ, 'A' * 37 + 'TTT', 3, 3)
+        assert not dnautils.window_hamming_exceeds(
+            germ, 'T' + 'A' * 38 + 'T', 39, 2)
+        assert dnautils.window_hamming_exceeds(
+            germ, 'T' + 'A' * 38 + 'T', 40, 2)
+
+        with self.assertRaises(dnautils.error):
+            dnautils.window_hamming_exceeds('ACG', 'AC', 2, 1)
+        with self.assertRaises(dnautils.error):
+            dnautils.window_hamming_exceeds('ACG', 'ACG', 0, 1)
+
+    def test_hamming_many(self):
+        seq = self.random_seqs(1, 40)[0]
+        others = self.random_seqs(50, 40)
+        assert dnautils.hamming_many(seq, others) == [
+            hamming(seq, o) for o in others]
+        # Counting stops once the maximum is exceeded
+        for max_distance in (0, 5, 20):
+            assert dnautils.hamming_many(seq, others, max_distance) == [
+                min(hamming(seq, o), max_distance + 1) for o in others]
+        assert dnautils.hamming_many(seq, []) == []
+        assert dnautils.hamming_many('', ['', '']) == [0, 0]
+        with self.assertRaises(dnautils.error):
+            dnautils.hamming_many(seq, others + [seq[1:]])
+
+    def test_hamming_matrix(self):
+        rows = self.random_seqs(10, 30)
+        cols = self.random_seqs(7, 30)
+        assert dnautils.hamming_matrix(rows, cols) == [
+            [hamming(r, c) for c in cols] for r in rows]
+        assert dnautils.hamming_matrix(rows) == [
+            [hamming(r, c) for c in rows] for r in rows]
+        assert dnautils.hamming_matrix([]) == []
+        assert dnautils.hamming_matrix([], cols) == []
+        assert dnautils.hamming_matrix(rows, []) == [[]] * len(rows)
+        with self.assertRaises(dnautils.error):
+            dnautils.hamming_matrix(rows, cols + ['A'])
+        with self.assertRaises(dnautils.error):
+            dnautils.hamming_matrix(rows + ['A'])
+        with self.assertRaises(dnautils.error):
+            dnautils.hamming_matrix([], ['A', 'AC'])
+
+    def test_equal_any(self):
+        seqs = self.random_seqs(200, 6, 'ACN-')
+        for seq in self.random_seqs(50, 6, 'ACN-'):
+            expected = next(
+                (i for i, s in enumerate(seqs) if equal(seq, s)), -1)
+            assert dnautils.equal_any(seq, seqs) == expected
+        # Ns match anything but gaps only match gaps and Ns, and sequences of
+        # other lengths are skipped
+        assert dnautils.equal_any('AGC', ['AC', 'A-C', 'AGC']) == 2
+        assert dnautils.equal_any('A-C', ['AGC', 'ANC']) == 1
+        assert dnautils.equal_any('ANC', ['AC', 'A-C']) == 1
+        assert dnautils.equal_any('A', []) == -1
+
+    def test_min_hamming_windows(self):
+        for _ in range(50):
+            seqs = self.random_seqs(self.rng.randint(0, 3),
+                                    self.rng.randint(0, 30))
+            germs = self.random_seqs(self.rng.randint(0, 3),
+                                     self.rng.randint(1, 12), 'ACGT')
+            for floor, max_distance in ((0, -1), (3, -1), (0, 4), (2, 2),
+                                        (0, 0)):
+                assert dnautils.min_hamming_windows(
+                    seqs, germs, floor, max_distance) == min_hamming_windows(
+                        seqs, germs, floor, max_distance)
+        # Germlines longer than every sequence have no windows
+        assert dnautils.min_hamming_windows(['ACG'], ['ACGT']) is None
+        assert dnautils.min_hamming_windows([], ['A']) is None
+        # The first window with the minimum distance is kept
+        assert dnautils.min_hamming_windows(
+            ['TTAGTAC', 'AC'], ['AC', 'TA']) == (0, 0, 5, 0)
+        assert dnautils.min_hamming_windows(
+            ['TTGGTTC'], ['AC', 'GG'], 1) == (0, 0, 5, 1)
+
+    def test_pack(self):
+        # Lengths which fill a word exactly, leave one spare, or spill into
+        # another
+        for length in (0, 1, 2, 31, 32, 33, 63, 64, 65, 127, 351):
+            for seq in self.random_seqs(5, length):
+                assert unpack(dnautils.pack(seq)) == seq
+        with self.assertRaises(dnautils.error):
+            dnautils.pack('ACGX')
+
+    def test_packed_equal_many(self):
+        for length in (1, 3, 32, 33, 65, 351):
+            seqs = self.random_seqs(100, length, 'ACN-')
+            # Some sequences are copies with Ns added so that equal pairs
+            # span every word
+            seqs += [''.join('N' if self.rng.random() < .1 else c
+                             for c in seq) for seq in seqs[:20]]
+            packed = [dnautils.pack(seq) for seq in seqs]
+            for seq, p in zip(seqs[:20], packed):
+                assert dnautils.packed_equal_many(p, packed) == [
+                    equal(seq, other) for other in seqs]
+        # Sequences of other lengths are never equal, even if only Ns
+        assert dnautils.packed_equal_many(dnautils.pack('NNN'), [
+            dnautils.pack(''), dnautils.pack('NN'), dnautils.pack('A-G'),
+            dnautils.pack('NNNN')]) == [False, False, True, False]
+        assert dnautils.packed_equal_many(dnautils.pack('A'), []) == []
+        with self.assertRaises(dnautils.error):
+            dnautils.packed_equal_many(dnautils.pack('A'), ['A'])
+
+    def test_get_equal_many(self):
+        seqs = self.random_seqs(50, 20, 'ACN-') + self.random_seqs(5, 21)
+        for extra in ([], ['ACRT'], ['acgt'], ['ACGX' * 5]):
+            keys, equal_many = get_equal_many(seqs + extra)
+            if extra:
+                # Sequences pack cannot encode are compared unpacked
+                assert equal_many is not dnautils.packed_equal_many
+            for seq, key in zip(seqs + extra, keys):
+                assert equal_many(key, keys) == [
+                    equal(seq, other) for other in seqs + extra]
+        # Lowercase and IUPAC bases only equal themselves and Ns
+        keys, equal_many = get_equal_many(['ACRT', 'ACGT', 'NNNN', 'AcRT',
+                                           'ACR'])
+        assert equal_many(keys[0], keys) == [True, False, True, False,
+                                             False]
@@ -0,0 +1,199 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from immunedb.identification import AlignmentException
+from immunedb.identification.alignment_cache import AlignmentCache
+from immunedb.identification.anchor import AnchorAligner
+from immunedb.identification.genes import load_germlines
+from immunedb.identification.identify import IdentificationProps
+from immunedb.identification.synthetic import SyntheticRepertoire
+from immunedb.identification.vdj_sequence import VDJSequence
+from immunedb.util.hyper import hypergeom, hypergeom_table
+from immunedb.util.reader import read_sequences
+
+V_PATH = os.path.join('tests', 'data', 'germlines', 'imgt_human_v.fasta')
+J_PATH = os.path.join('tests', 'data', 'germlines', 'imgt_human_j.fasta')
+READS_PATH = os.path.join('tests', 'data', 'identification', 'input.fastq')
+
+
+class GermlineCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_cache(self):
+        v, j = load_germlines(V_PATH, J_PATH, cache_dir=self.cache_dir)
+        assert len(os.listdir(self.cache_dir)) == 1
+        cached_v, cached_j = load_germlines(V_PATH, J_PATH,
+                                            cache_dir=self.cache_dir)
+        assert len(os.listdir(self.cache_dir)) == 1
+        assert cached_v.ties == v.ties
+        assert cached_v.names == v.names
+
+        uncached_v, uncached_j = load_germlines(V_PATH, J_PATH)
+        for name in uncached_v:
+            for length in (100, 250):
+                assert (cached_v.get_single_tie(name, length, .1) ==
+                        uncached_v.get_single_tie(name, length, .1))
+        for name in uncached_j:
+            assert (cached_j.get_single_tie(name, None, None) ==
+                    uncached_j.get_single_tie(name, None, None))
+
+        load_germlines(V_PATH, J_PATH, anchor_len=15,
+                       cache_dir=self.cache_dir)
+        assert len(os.listdir(self.cache_dir)) == 2
+
+
+class AlignmentCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def align(self, aligner, cache):
+        results = []
+        for i, (_, seq, _) in enumerate(read_sequences(READS_PATH)):
+            if i == 100:
+                break
+            try:
+                vdj = VDJSequence('x', seq)
+            except ValueError:
+                continue
+            try:
+                alignment = (cache.get_alignment(aligner, vdj) if cache
+                             else aligner.get_alignment(vdj))
+                results.append((alignment.sequence.sequence,) +
+                               alignment.__getstate__()[1:])
+            except AlignmentException as e:
+                results.append(str(e))
+        return results
+
+    def get_used(self, cache):
+        conn = sqlite3.connect(cache._path)
+        used = {str(key): value for key, value in conn.execute(
+            'SELECT key, used FROM alignments')}
+        conn.close()
+        return used
+
+    def test_cache(self):
+        v, j = load_germlines(V_PATH, J_PATH)
+        aligner = AnchorAligner(v, j)
+        cache = AlignmentCache(os.path.join(self.cache_dir, 'cache'), v, j,
+                               IdentificationProps())
+        expected = self.align(aligner, None)
+        assert self.align(aligner, cache) == expected
+        assert cache.get_stats()['misses'] > 0
+        used = self.get_used(cache)
+        assert self.align(aligner, cache) == expected
+        assert cache.get_stats()['hits'] == len(expected)
+        # The times entries were used are written in batches
+        assert self.get_used(cache) == used
+        cache.close()
+        assert all(self.get_used(cache)[key] > used[key] for key in used)
+
+        small = AlignmentCache(os.path.join(self.cache_dir, 'small'), v, j,
+                               IdentificationProps(), max_size=5000)
+        assert self.align(aligner, small) == expected
+        assert small.get_stats()['evicted'] > 0
+
+
+class HypergeomTest(unittest.TestCase):
+    def test_table(self):
+        for length in (1, 2, 100, 288):
+            for mutation in (.05, .15, .30):
+                table = hypergeom_table(length, mutation)
+                assert len(table) == length + 1
+                for K in range(length + 1):
+                    assert table[K] == hypergeom(length, mutation, K)
+
+
+class VPrefilterTest(unittest.TestCase):
+    def test_shortlist_alleles(self):
+        v, j = load_germlines(V_PATH, J_PATH)
+        index = v.get_kmer_index()
+        for i, name in enumerate(v.names):
+            rows = index.shortlist(v[name].replace('-', ''), 1)
+            assert i in rows
+            assert set(v.names[r] for r in rows) >= v.all_alleles([name])
+
+    def test_prefilter_calls(self):
+        v, j = load_germlines(V_PATH, J_PATH)
+        full = AnchorAligner(v, j)
+        prefiltered = AnchorAligner(v, j, v_prefilter=20)
+        total = same = 0
+        for _, seq, _ in read_sequences(READS_PATH):
+            try:
+                expected = full.get_alignment(VDJSequence('x', seq))
+            except (AlignmentException, ValueError):
+                continue
+            alignment = prefiltered.get_alignment(VDJSequence('x', seq))
+            total += 1
+            same += (alignment.v_gene == expected.v_gene and
+                     alignment.seq_offset == expected.seq_offset)
+        assert same >= .99 * total
+
+
+class OrientationTest(unittest.TestCase):
+    def test_reverse_complement(self):
+        v, j = load_germlines(V_PATH, J_PATH)
+        aligner = AnchorAligner(v, j)
+        for i, (_, seq, _) in enumerate(read_sequences(READS_PATH)):
+            if i == 100:
+                break
+            try:
+                vdj = VDJSequence('x', seq)
+                expected = aligner.get_alignment(vdj)
+            except (AlignmentException, ValueError):
+                continue
+            alignment = aligner.get_alignment(vdj.reverse_complement())
+            assert alignment.sequence.sequence == expected.sequence.sequence
+            assert alignment.v_gene == expected.v_gene
+            assert alignment.j_gene == expected.j_gene
+
+
+class GermlineKmersTest(unittest.TestCase):
+    def test_rejection(self):
+        v, j = load_germlines(V_PATH, J_PATH)
+        aligner = AnchorAligner(v, j, min_germline_kmers=10)
+        reasons = []
+        for i, (_, seq, _) in enumerate(read_sequences(READS_PATH)):
+            if i == 100:
+                break
+            try:
+                aligner.get_alignment(VDJSequence('x', seq))
+            except (AlignmentException, ValueError) as e:
+                reasons.append(str(e))
+        try:
+            aligner.get_alignment(VDJSequence('x', 'ACGTTGCA' * 40))
+        except AlignmentException as e:
+            reasons.append(str(e))
+        rejected = [reason for reason in reasons
+                    if reason.startswith(AnchorAligner.GERMLINE_KMERS_REASON)]
+        assert len(rejected) == 1
+
+
+class SyntheticTest(unittest.TestCase):
+    def test_generate(self):
+        v, j = load_germlines(V_PATH, J_PATH)
+        repertoire = SyntheticRepertoire(v, j, rc_rate=.5, seed=1)
+        reads = list(repertoire.generate(200))
+        assert reads == list(repertoire.generate(200))
+        assert len(set(seq for _, seq, _ in reads)) < len(reads)
+
+        aligner = AnchorAligner(v, j)
+        correct = 0
+        for seq_id, seq, quality in reads:
+            try:
+                alignment = aligner.get_alignment(
+                    VDJSequence(seq_id, seq, quality))
+            except AlignmentException:
+                continue
+            v_name = seq_id.split('|')[1]
+            correct += v_name in [str(gene) for gene in alignment.v_gene]
+        assert correct >= .8 * len(reads)
@@ -0,0 +1,204 @@
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import immunedb.common.config as config
+from immunedb.common.models import (DuplicateSequence,
+                                    IdentificationProgress, NoResult, Sample,
+                                    Sequence, Study, Subject)
+from immunedb.identification import (add_as_noresult, add_as_sequence,
+                                     AlignmentException, rollback_sample,
+                                     SequenceWriter)
+from immunedb.identification.anchor import AnchorAligner
+from immunedb.identification.genes import load_germlines
+from immunedb.identification.identify import run_identify
+from immunedb.identification.metadata import (MetadataException,
+                                              parse_metadata)
+from immunedb.identification.vdj_sequence import VDJSequence
+from immunedb.util.reader import read_sequences
+
+import sqlite_db
+
+
+def get_alignments():
+    v, j = load_germlines('tests/data/germlines/imgt_human_v.fasta',
+                          'tests/data/germlines/imgt_human_j.fasta')
+    aligner = AnchorAligner(v, j)
+    alignments = []
+    for i, (seq_id, seq, quality) in enumerate(read_sequences(
+            'tests/data/identification/input.fastq')):
+        if i == 100:
+            break
+        try:
+            vdj = VDJSequence([seq_id] + [
+                '{}_dup{}'.format(seq_id, d) for d in range(i % 3)
+            ], seq, quality)
+            alignment = aligner.get_alignment(vdj)
+            aligner.align_to_germline(alignment)
+        except (AlignmentException, ValueError):
+            continue
+        alignments.append(alignment)
+    return alignments
+
+
+def get_identify_args(db_path, **kwargs):
+    """Gets the arguments to identify the samples in
+    ``tests/data/identification`` into the database at ``db_path``, replacing
+    any given as keyword arguments."""
+    args = dict(
+        db_config=db_path, nproc=1,
+        v_germlines='tests/data/germlines/imgt_human_v.fasta',
+        j_germlines='tests/data/germlines/imgt_human_j.fasta',
+        upstream_of_cdr3=31, anchor_len=18, min_anchor_len=12,
+        germline_cache=None, alignment_cache=None,
+        sample_dir='tests/data/identification', metadata=None,
+        max_vties=50, min_similarity=.60, trim=0, warn_existing=False,
+        resume=False, shard_samples=False, dedup_memory=None,
+        stream_sample_size=None, writer_process=False, temp='/tmp',
+        trim_to=None, max_padding=None)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+class SQLiteTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.session = sqlite_db.init_db(
+            os.path.join(self.temp_dir, 'test.db'), drop_all=True)
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.temp_dir)
+
+
+class SequenceWriterTest(SQLiteTest):
+    def get_written(self, sample):
+        seqs = self.session.query(Sequence).filter(
+            Sequence.sample_id == sample.id).order_by(Sequence.ai).all()
+        seq_ids = {seq.ai: seq.seq_id for seq in seqs}
+        duplicates = {
+            dup.seq_id: seq_ids[dup.duplicate_seq_ai]
+            for dup in self.session.query(DuplicateSequence).filter(
+                DuplicateSequence.sample_id == sample.id)
+        }
+        return [seq.seq_id for seq in seqs], duplicates
+
+    def test_matches_add_as_sequence(self):
+        study = Study(name='study')
+        subject = Subject(study=study, identifier='subject')
+        one_by_one, batched = [
+            Sample(name=name, date=datetime.date.today(), study=study,
+                   subject=subject)
+            for name in ('one_by_one', 'batched')
+        ]
+        self.session.add_all([one_by_one, batched])
+        self.session.commit()
+
+        alignments = get_alignments()
+        assert len(alignments) > 0
+        for alignment in alignments:
+            add_as_sequence(self.session, alignment, one_by_one)
+        self.session.commit()
+        # A batch size not dividing the number of sequences spans batches
+        writer = SequenceWriter(self.session, batched, batch_size=7)
+        for alignment in alignments:
+            writer.add(alignment)
+        writer.flush()
+        self.session.commit()
+
+        expected = self.get_written(one_by_one)
+        assert len(expected[0]) > 0 and len(expected[1]) > 0
+        self.assertEqual(self.get_written(batched), expected)
+
+
+class ResumeTest(SQLiteTest):
+    METADATA_PATH = 'tests/data/identification/metadata.tsv'
+
+    def parse_metadata(self, warn_existing=False, resume=False):
+        with open(self.METADATA_PATH) as fh:
+            return parse_metadata(self.session, fh, warn_existing,
+                                  'tests/data/identification', resume)
+
+    def add_sample(self, name, alignments):
+        study = self.session.query(Study).filter(
+            Study.name == 'Test Study').first() or Study(name='Test Study')
+        sample = Sample(name=name, date=datetime.date.today(), study=study,
+                        subject=Subject(study=study, identifier=name))
+        self.session.add(sample)
+        self.session.commit()
+        for alignment in alignments:
+            add_as_sequence(self.session, alignment, sample)
+        add_as_noresult(self.session, alignments[0].sequence, sample,
+                        'reason')
+        return sample
+
+    def count_rows(self, sample):
+        return [self.session.query(model).filter(
+            model.sample_id == sample.id).count()
+            for model in (DuplicateSequence, Sequence, NoResult,
+                          IdentificationProgress)]
+
+    def test_partial_sample(self):
+        alignments = get_alignments()
+        interrupted = self.add_sample('input', alignments[:10])
+        complete = self.add_sample('other', alignments[10:20])
+        self.session.add_all([
+            IdentificationProgress(sample=interrupted, complete=False),
+            IdentificationProgress(sample=complete, complete=True),
+        ])
+        self.session.commit()
+
+        # Partially identified samples are an error, skipped, or resumed
+        with self.assertRaises(MetadataException):
+            self.parse_metadata()
+        assert sorted(self.parse_metadata(warn_existing=True)) == ['input2']
+        assert sorted(self.parse_metadata(resume=True)) == ['input',
+                                                            'input2']
+
+        expected = self.count_rows(complete)
+        rows = self.count_rows(interrupted)
+        assert rows[0] > 0
+        deleted = rollback_sample(self.session, interrupted.id)
+        self.assertEqual(deleted.values(), [0] + rows)
+        assert self.count_rows(interrupted) == [0, 0, 0, 0]
+        # Other samples are not affected
+        assert self.count_rows(complete) == expected
+
+        # Completed samples are skipped when resuming
+        self.session.add(IdentificationProgress(sample=interrupted,
+                                                complete=True))
+        self.session.commit()
+        with self.assertRaises(MetadataException):
+            self.parse_metadata()
+        assert sorted(self.parse_metadata(resume=True)) == ['input2']
+
+    def test_resume_identification(self):
+        restore = sqlite_db.use_sqlite()
+        self.addCleanup(restore)
+        fresh_path = os.path.join(self.temp_dir, 'fresh.db')
+        run_identify(config.init_db(fresh_path, drop_all=True),
+                     get_identify_args(fresh_path))
+        fresh = config.init_db(fresh_path)
+        expected = {}
+        for sample in fresh.query(Sample):
+            expected[sample.name] = [fresh.query(model).filter(
+                model.sample_id == sample.id).count()
+                for model in (DuplicateSequence, Sequence, NoResult,
+                              IdentificationProgress)]
+        fresh.close()
+
+        interrupted = self.add_sample('input', get_alignments()[:10])
+        self.session.add(IdentificationProgress(sample=interrupted,
+                                                complete=False))
+        self.session.commit()
+        run_identify(self.session, get_identify_args(
+            os.path.join(self.temp_dir, 'test.db'), resume=True))
+
+        # The interrupted sample is rolled back and identified again
+        self.session.expire_all()
+        assert expected['input'][1] > 0
+        for sample in self.session.query(Sample):
+            self.assertEqual(self.count_rows(sample), expected[sample.name])
@@ -20,6 +20,8 @@ class TestImport(BaseTest.RegressionTest):
             upstream_of_cdr3=31,
             anchor_len=18,
             min_anchor_len=12,
+            germline_cache=None,
+            alignment_cache=None,
             study_name='Test',
             sample_name='input',
             subject='Subject 1',
@@ -16,12 +16,20 @@ class TestPipeline(BaseTest.RegressionTest):
                 upstream_of_cdr3=31,
                 anchor_len=18,
                 min_anchor_len=12,
+                germline_cache=None,
+                alignment_cache=None,
                 sample_dir='tests/data/identification',
                 metadata=None,
                 max_vties=50,
                 min_similarity=.60,
                 trim=0,
                 warn_existing=False,
+                resume=False,
+                shard_samples=False,
+                dedup_memory=None,
+                stream_sample_size=None,
+                writer_process=False,
+                temp='/tmp',
                 trim_to=None,
                 max_padding=None
             )
@@ -0,0 +1,51 @@
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from immunedb.util.reader import (read_sequences, is_sequence_file,
+                                  sample_name_from_file)
+
+FASTQ_PATH = os.path.join('tests', 'data', 'identification', 'input.fastq')
+
+
+class ReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_fastq(self):
+        records = list(read_sequences(FASTQ_PATH))
+        assert len(records) == 563
+        for seq_id, seq, qual in records:
+            assert len(seq) == len(qual)
+
+    def test_compressed(self):
+        records = list(read_sequences(FASTQ_PATH))
+        for ext, opener in (('gz', gzip.open), ('bz2', bz2.BZ2File)):
+            path = os.path.join(self.temp, 'input.fastq.{}'.format(ext))
+            with open(FASTQ_PATH) as src:
+                dest = opener(path, 'wb')
+                shutil.copyfileobj(src, dest)
+                dest.close()
+            assert list(read_sequences(path)) == records
+
+    def test_fasta(self):
+        path = os.path.join(self.temp, 'input.fasta')
+        with open(path, 'w+') as fh:
+            fh.write('>seq1 extra\nATCG\nATCG\n>seq2\nNNNN\n')
+        assert list(read_sequences(path)) == [
+            ('seq1 extra', 'ATCGATCG', None),
+            ('seq2', 'NNNN', None)
+        ]
+
+    def test_file_names(self):
+        assert is_sequence_file('sample.fastq.gz')
+        assert is_sequence_file('sample.fasta.bz2')
+        assert not is_sequence_file('metadata.tsv')
+        assert sample_name_from_file('/a/sample1.fastq.gz') == 'sample1'
+        assert sample_name_from_file('sample1.fasta') == 'sample1'
@@ -0,0 +1,90 @@
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+import immunedb.common.config as config
+from immunedb.common.models import (DuplicateSequence, NoResult, Sample,
+                                    Sequence)
+from immunedb.identification.identify import run_identify
+from immunedb.identification.writer import DatabaseWriter, WriterException
+
+import sqlite_db
+from tests_identification import get_identify_args
+
+
+class DatabaseWriterTest(unittest.TestCase):
+    def test_startup_failure(self):
+        writer = DatabaseWriter('/nonexistent.json')
+        # More batches than fit in the queue are accepted and discarded
+        for _ in range(40):
+            writer.bulk_save_objects([None] * 1000)
+        with self.assertRaises(WriterException):
+            writer.sync()
+        assert 'nonexistent.json' in writer.reset()
+        writer.close()
+
+    def test_killed(self):
+        writer = DatabaseWriter('/nonexistent.json')
+        os.kill(writer._process.pid, signal.SIGKILL)
+        writer._process.join()
+        with self.assertRaises(WriterException):
+            writer.sync()
+        with self.assertRaises(WriterException):
+            for _ in range(40):
+                writer.bulk_save_objects([None] * 1000)
+        writer.close()
+
+
+class IdentifyWithWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.restore = sqlite_db.use_sqlite()
+
+    def tearDown(self):
+        self.restore()
+        shutil.rmtree(self.temp_dir)
+
+    def identify(self, name, **kwargs):
+        db_path = os.path.join(self.temp_dir, '{}.db'.format(name))
+        session = config.init_db(db_path, drop_all=True)
+        run_identify(session, get_identify_args(db_path, **kwargs))
+
+        session = config.init_db(db_path)
+        results = {}
+        for sample in session.query(Sample):
+            results[sample.name] = (
+                round(sample.v_ties_len, 4),
+                round(sample.v_ties_mutations, 4),
+                sorted(
+                    (seq.seq_id, seq.v_gene, seq.j_gene, seq.copy_number,
+                     seq.sequence)
+                    for seq in session.query(Sequence).filter(
+                        Sequence.sample_id == sample.id)),
+                sorted(r.seq_id for r in session.query(NoResult).filter(
+                    NoResult.sample_id == sample.id)),
+                sorted(d.seq_id for d in session.query(
+                    DuplicateSequence).filter(
+                        DuplicateSequence.sample_id == sample.id)),
+            )
+        session.close()
+        return results
+
+    def test_matches_session(self):
+        expected = self.identify('session')
+        assert sorted(expected) == ['input', 'input2']
+        assert all(len(r[2]) > 0 and len(r[3]) > 0 and len(r[4]) > 0
+                   for r in expected.values())
+        # Each sample is written through the writer process, including when
+        # samples are identified by more than one worker at once
+        self.assertEqual(self.identify('writer', writer_process=True),
+                         expected)
+        self.assertEqual(self.identify('writer_nproc', writer_process=True,
+                                       nproc=2), expected)
+
+    def test_streaming(self):
+        self.assertEqual(
+            self.identify('stream_writer', writer_process=True,
+                          stream_sample_size=100),
+            self.identify('stream_session', stream_sample_size=100))